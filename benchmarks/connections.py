@@ -0,0 +1,206 @@
+"""Measure the latency of fanned out API calls with different connection pools
+
+The fake API is served over TLS with a self-signed certificate so that
+opening a connection costs a handshake, like it does with Spotify.
+
+Usage:
+
+    python benchmarks/connections.py --requests 200 --latency 0.05
+
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import ssl
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Mapping, Optional
+
+import aiohttp
+from aiohttp import web
+from cryptography import x509
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+
+from spotify_party import pool
+from spotify_party.config import validate_config
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fake_spotify import fake_spotify_app  # noqa: E402 isort:skip
+
+
+def get_ssl_context() -> ssl.SSLContext:
+    # cryptography 2.8 still needs the backend
+    backend = default_backend()
+    key = ec.generate_private_key(ec.SECP256R1(), backend)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "127.0.0.1")])
+    now = datetime.datetime.utcnow()
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now)
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .sign(key, hashes.SHA256(), backend)
+    )
+    directory = tempfile.mkdtemp()
+    certfile = os.path.join(directory, "cert.pem")
+    keyfile = os.path.join(directory, "key.pem")
+    with open(certfile, "wb") as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(keyfile, "wb") as f:
+        f.write(
+            key.private_bytes(
+                serialization.Encoding.PEM,
+                serialization.PrivateFormat.PKCS8,
+                serialization.NoEncryption(),
+            )
+        )
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(certfile, keyfile)
+    return context
+
+
+async def start_site(app: web.Application) -> web.AppRunner:
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0, ssl_context=get_ssl_context())
+    await site.start()
+    return runner
+
+
+def get_config(**overrides: Any) -> Mapping[str, Any]:
+    config = dict(
+        spotify_client_id="id",
+        spotify_client_secret="secret",
+        spotify_redirect_uri="http://localhost/spotify/callback",
+        base_url="http://localhost",
+        database_filename=":memory:",
+    )
+    config.update(overrides)
+    return validate_config(config)
+
+
+async def warm_up(
+    session: aiohttp.ClientSession, url: str, number: int
+) -> None:
+    # Like pool.warm_up, but without checking the self-signed certificate
+    async def connect() -> None:
+        async with session.head(url, ssl=False):
+            pass
+
+    await asyncio.gather(*(connect() for _ in range(number)))
+
+
+async def fan_out(
+    session: aiohttp.ClientSession, url: str, number: int
+) -> List[float]:
+    async def call(n: int) -> float:
+        start = time.monotonic()
+        async with session.get(
+            url, headers={"Authorization": f"Bearer user{n}"}, ssl=False
+        ) as response:
+            await response.read()
+        return time.monotonic() - start
+
+    return await asyncio.gather(*(call(n) for n in range(number)))
+
+
+def summarize(name: str, latencies: List[float], elapsed: float) -> None:
+    values = sorted(latencies)
+    p50 = 1000 * values[len(values) // 2]
+    p99 = 1000 * values[min(len(values) - 1, int(0.99 * len(values)))]
+    print(f"{name:<28}{p50:>10.1f}{p99:>10.1f}{1000 * elapsed:>12.1f}")
+
+
+async def measure(
+    name: str,
+    make_session: Callable[[], aiohttp.ClientSession],
+    url: str,
+    args: argparse.Namespace,
+    warm: Optional[int] = None,
+) -> None:
+    async with make_session() as session:
+        if warm is not None:
+            await warm_up(session, url, warm)
+        for n in range(args.rounds):
+            if n:
+                await asyncio.sleep(args.idle)
+            start = time.monotonic()
+            latencies = await fan_out(session, url, args.requests)
+            summarize(f"{name} #{n + 1}", latencies, time.monotonic() - start)
+
+
+async def run(args: argparse.Namespace) -> None:
+    fake = await start_site(fake_spotify_app(latency=args.latency))
+    host, port = fake.addresses[0][:2]
+    api_url = f"https://{host}:{port}/v1"
+    url = f"{api_url}/me"
+    config = get_config(spotify_api_url=api_url, **args.config)
+    stats = pool.PoolStats()
+
+    print(f"{'pool':<28}{'p50 ms':>10}{'p99 ms':>10}{'fan-out ms':>12}")
+    await measure("default", aiohttp.ClientSession, url, args)
+    await measure(
+        "tuned", lambda: pool.create_session(config, stats), url, args
+    )
+    await measure(
+        "tuned, warmed",
+        lambda: pool.create_session(config, stats),
+        url,
+        args,
+        warm=config["spotify_warm_connections"],
+    )
+
+    totals: Dict[str, int] = {}
+    for (_, outcome), value in stats.totals.items():
+        totals[outcome] = totals.get(outcome, 0) + value
+    print(
+        "tuned pools: "
+        + ", ".join(
+            f"{name} {value}" for name, value in sorted(totals.items())
+        )
+    )
+    await fake.cleanup()
+
+
+def parse_config(values: List[str]) -> Dict[str, Any]:
+    config = {}
+    for value in values:
+        name, _, setting = value.partition("=")
+        config[name] = json.loads(setting)
+    return config
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--rounds", type=int, default=2)
+    parser.add_argument(
+        "--idle",
+        type=float,
+        default=20.0,
+        help="seconds between rounds, longer than aiohttp's default "
+        "keep-alive",
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.05, help="mean API latency (s)"
+    )
+    parser.add_argument(
+        "--config",
+        action="append",
+        default=[],
+        metavar="NAME=JSON",
+        help="override an app setting, e.g. spotify_pool_size=200",
+    )
+    args = parser.parse_args()
+    args.config = parse_config(args.config)
+    asyncio.run(run(args))
@@ -0,0 +1,171 @@
+"""A local stand-in for the parts of the Spotify Web API used by the app
+
+Access tokens are mapped directly to user IDs so that the load test can seed
+the database with users that this server will recognize.
+
+"""
+
+__all__ = ["fake_spotify_app"]
+
+import asyncio
+import random
+import time
+from typing import Any, Dict, Optional
+
+from aiohttp import web
+
+routes = web.RouteTableDef()
+
+
+class Player:
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self.device_id: Optional[str] = None
+        self.uri = "spotify:track:0"
+        self.position_ms = 0
+        self.updated_at = time.monotonic()
+        self.is_playing = False
+
+    @property
+    def progress_ms(self) -> int:
+        if not self.is_playing:
+            return self.position_ms
+        return int(
+            self.position_ms + 1000 * (time.monotonic() - self.updated_at)
+        )
+
+    def seek(self, position_ms: int) -> None:
+        self.position_ms = position_ms
+        self.updated_at = time.monotonic()
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            "progress_ms": self.progress_ms,
+            "is_playing": self.is_playing,
+            "item": {
+                "uri": self.uri,
+                "name": "A song",
+                "type": "track",
+                "id": self.uri.split(":")[-1],
+                "duration_ms": 240000,
+            },
+        }
+
+
+def get_player(request: web.Request) -> Player:
+    token = request.headers.get("Authorization", "")[len("Bearer ") :]
+    if not token:
+        raise web.HTTPUnauthorized()
+    players = request.app["players"]
+    if token not in players:
+        players[token] = Player(token)
+    return players[token]
+
+
+@web.middleware
+async def inject_faults(request: web.Request, handler: Any) -> web.Response:
+    app = request.app
+    app["requests"] += 1
+    if app["latency"] > 0:
+        await asyncio.sleep(random.expovariate(1.0 / app["latency"]))
+    if random.random() < app["error_rate"]:
+        app["errors"] += 1
+        if random.random() < 0.5:
+            return web.Response(status=429, headers={"Retry-After": "1"})
+        return web.Response(status=503)
+    return await handler(request)
+
+
+@routes.post("/api/token")
+async def token(request: web.Request) -> web.Response:
+    data = await request.post()
+    return web.json_response(
+        {"access_token": data.get("refresh_token"), "expires_in": 3600}
+    )
+
+
+@routes.get("/v1/me")
+async def me(request: web.Request) -> web.Response:
+    player = get_player(request)
+    return web.json_response(
+        {
+            "id": player.user_id,
+            "display_name": player.user_id,
+            "product": "premium",
+        }
+    )
+
+
+@routes.put("/v1/me/player")
+async def transfer(request: web.Request) -> web.Response:
+    player = get_player(request)
+    data = await request.json()
+    player.device_id = data["device_ids"][0]
+    if data.get("play", False):
+        player.seek(player.progress_ms)
+        player.is_playing = True
+    return web.Response(status=204)
+
+
+@routes.get("/v1/me/player/devices")
+async def devices(request: web.Request) -> web.Response:
+    player = get_player(request)
+    devices = []
+    if player.device_id is not None:
+        devices.append({"id": player.device_id, "is_active": True})
+    return web.json_response({"devices": devices})
+
+
+@routes.put("/v1/me/player/play")
+async def play(request: web.Request) -> web.Response:
+    player = get_player(request)
+    if player.device_id is None:
+        raise web.HTTPNotFound()
+    data = await request.json() if request.can_read_body else {}
+    if "uris" in data:
+        player.uri = data["uris"][0]
+        player.seek(0)
+    if "position_ms" in data:
+        player.seek(data["position_ms"])
+    else:
+        player.seek(player.progress_ms)
+    player.is_playing = True
+    return web.Response(status=204)
+
+
+@routes.put("/v1/me/player/pause")
+async def pause(request: web.Request) -> web.Response:
+    player = get_player(request)
+    player.seek(player.progress_ms)
+    player.is_playing = False
+    return web.Response(status=204)
+
+
+@routes.get("/v1/me/player/currently-playing")
+async def currently_playing(request: web.Request) -> web.Response:
+    player = get_player(request)
+    if player.device_id is None:
+        return web.Response(status=204)
+    return web.json_response(player.to_json())
+
+
+def fake_spotify_app(
+    *, latency: float = 0.0, error_rate: float = 0.0
+) -> web.Application:
+    """Build the fake API
+
+    Args:
+        latency (float, optional): The mean of the exponentially distributed
+            delay added to every response, in seconds
+        error_rate (float, optional): The fraction of requests that fail with
+            a 429 or 503 response
+
+    """
+    app = web.Application(middlewares=[inject_faults])
+    app["latency"] = latency
+    app["error_rate"] = error_rate
+    app["players"] = {}
+    app["requests"] = 0
+    app["errors"] = 0
+    app.add_routes(routes)
+    return app
@@ -0,0 +1,257 @@
+"""Measure the capacity of the app against a fake Spotify API
+
+Usage:
+
+    python benchmarks/loadtest.py --hosts 4 --listeners 50 --latency 0.05
+
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Mapping, Optional
+
+import socketio
+from aiohttp import ClientSession, web
+from aiohttp_spotify import SpotifyAuth
+from cryptography import fernet
+
+from spotify_party import app_factory, create_tables
+from spotify_party.config import validate_config
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fake_spotify import fake_spotify_app  # noqa: E402 isort:skip
+
+
+class Recorder:
+    def __init__(self) -> None:
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.events: Dict[str, int] = defaultdict(int)
+
+    def report(self, elapsed: float) -> None:
+        print(
+            f"{'endpoint':<22}{'calls':>8}{'errors':>8}"
+            f"{'p50 ms':>10}{'p99 ms':>10}{'req/s':>10}"
+        )
+        for name, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            p50 = 1000 * values[len(values) // 2]
+            p99 = 1000 * values[min(len(values) - 1, int(0.99 * len(values)))]
+            print(
+                f"{name:<22}{len(values):>8}{self.errors[name]:>8}"
+                f"{p50:>10.1f}{p99:>10.1f}{len(values) / elapsed:>10.1f}"
+            )
+        for name, count in sorted(self.events.items()):
+            print(f"socket.io '{name}' events received: {count}")
+
+
+def session_cookie(key: str, user_id: str) -> str:
+    data = {"created": int(time.time()), "session": {"sp_user_id": user_id}}
+    return (
+        fernet.Fernet(key.encode("utf-8"))
+        .encrypt(json.dumps(data).encode("utf-8"))
+        .decode("utf-8")
+    )
+
+
+class Client:
+    def __init__(
+        self, base_url: str, user_id: str, key: str, recorder: Recorder
+    ):
+        self.base_url = base_url
+        self.user_id = user_id
+        self.device_id = f"device-{user_id}"
+        self.cookies = {"AIOHTTP_SESSION": session_cookie(key, user_id)}
+        self.recorder = recorder
+        self.session = ClientSession(cookies=self.cookies)
+        self.sio: Optional[socketio.AsyncClient] = None
+
+    async def call(
+        self, name: str, path: str, data: Optional[Mapping[str, Any]] = None
+    ) -> Mapping[str, Any]:
+        data = dict(device_id=self.device_id, **(data or {}))
+        start = time.monotonic()
+        async with self.session.post(self.base_url + path, json=data) as r:
+            body = await r.json(content_type=None)
+        self.recorder.latencies[name].append(time.monotonic() - start)
+        if r.status != 200 or "error" in body:
+            self.recorder.errors[name] += 1
+        return body
+
+    async def connect(self) -> None:
+        self.sio = socketio.AsyncClient(reconnection=False)
+        for event in ("listeners", "changed", "playback", "close"):
+            self.sio.on(event, self._counter(event))
+        cookie = "; ".join(f"{k}={v}" for k, v in self.cookies.items())
+        await self.sio.connect(self.base_url, headers={"Cookie": cookie})
+
+    def _counter(self, event: str) -> Any:
+        async def handler(data: Any = None) -> None:
+            self.recorder.events[event] += 1
+
+        return handler
+
+    async def close(self) -> None:
+        if self.sio is not None:
+            await self.sio.disconnect()
+        await self.session.close()
+
+
+async def start_site(app: web.Application) -> web.AppRunner:
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    return runner
+
+
+def get_url(runner: web.AppRunner) -> str:
+    host, port = runner.addresses[0][:2]
+    return f"http://{host}:{port}"
+
+
+async def run(args: argparse.Namespace) -> None:
+    recorder = Recorder()
+
+    fake = await start_site(
+        fake_spotify_app(latency=args.latency, error_rate=args.error_rate)
+    )
+    fake_url = get_url(fake)
+
+    database = os.path.join(tempfile.mkdtemp(), "loadtest.db")
+    create_tables(database)
+    key = fernet.Fernet.generate_key().decode("utf-8")
+    config = validate_config(
+        dict(
+            spotify_client_id="client-id",
+            spotify_client_secret="client-secret",
+            spotify_redirect_uri="http://127.0.0.1/spotify/callback",
+            spotify_token_url=f"{fake_url}/api/token",
+            spotify_api_url=f"{fake_url}/v1",
+            base_url="http://127.0.0.1",
+            database_filename=database,
+            session_key=key,
+            **args.config,
+        )
+    )
+    app = app_factory(config)
+    runner = await start_site(app)
+    base_url = get_url(runner)
+
+    # Seed the users; the fake API uses the user ID as the access token
+    hosts = [f"host{n}" for n in range(args.hosts)]
+    listeners = {
+        host: [f"{host}-listener{n}" for n in range(args.listeners)]
+        for host in hosts
+    }
+    expires_at = int(time.time()) + 3600
+    for user_id in hosts + sum(listeners.values(), []):
+        await app["db"].add_user(
+            user_id, user_id, SpotifyAuth(user_id, user_id, expires_at)
+        )
+
+    clients = {
+        user_id: Client(base_url, user_id, key, recorder)
+        for user_id in hosts + sum(listeners.values(), [])
+    }
+    await asyncio.gather(*(client.connect() for client in clients.values()))
+
+    start = time.monotonic()
+
+    # Start the rooms
+    room_ids = {}
+    for host in hosts:
+        response = await clients[host].call(
+            "broadcast/start",
+            "/api/broadcast/start",
+            dict(room_name=f"room-{host}"),
+        )
+        room_ids[host] = response["room_id"]
+
+    # Everyone joins at once
+    async def join(user_id: str, room_id: str) -> None:
+        await clients[user_id].call(
+            "listen/start", "/api/listen/start", dict(room_id=room_id)
+        )
+        await clients[user_id].sio.emit("join", room_id)
+
+    await asyncio.gather(
+        *(
+            join(user_id, room_ids[host])
+            for host in hosts
+            for user_id in listeners[host]
+        )
+    )
+
+    # The hosts change tracks while the listeners sync
+    async def host_loop(host: str) -> None:
+        for n in range(args.rounds):
+            await clients[host].call(
+                "broadcast/change",
+                "/api/broadcast/change",
+                dict(uri=f"spotify:track:{n}", position_ms=0),
+            )
+            await asyncio.sleep(args.period)
+
+    async def listener_loop(user_id: str) -> None:
+        for n in range(args.rounds):
+            await asyncio.sleep(args.period)
+            await clients[user_id].call("listen/sync", "/api/listen/sync")
+
+    await asyncio.gather(
+        *(host_loop(host) for host in hosts),
+        *(
+            listener_loop(user_id)
+            for host in hosts
+            for user_id in listeners[host]
+        ),
+    )
+    elapsed = time.monotonic() - start
+
+    await asyncio.gather(*(client.close() for client in clients.values()))
+    await runner.cleanup()
+    await fake.cleanup()
+
+    recorder.report(elapsed)
+    print(
+        f"fake Spotify API: {fake.app['requests']} requests, "
+        f"{fake.app['errors']} injected errors, {elapsed:.1f} s total"
+    )
+
+
+def parse_config(values: List[str]) -> Dict[str, Any]:
+    config = {}
+    for value in values:
+        name, _, setting = value.partition("=")
+        config[name] = json.loads(setting)
+    return config
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--hosts", type=int, default=2)
+    parser.add_argument("--listeners", type=int, default=20)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument(
+        "--period", type=float, default=1.0, help="seconds between changes"
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.02, help="mean API latency (s)"
+    )
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument(
+        "--config",
+        action="append",
+        default=[],
+        metavar="NAME=JSON",
+        help="override an app setting, e.g. fanout_concurrency=50",
+    )
+    args = parser.parse_args()
+    args.config = parse_config(args.config)
+    asyncio.run(run(args))
@@ -0,0 +1,87 @@
+"""Measure the CPU time spent on session cookies with and without caching
+
+Usage:
+
+    python benchmarks/sessions.py --requests 20000 --users 100
+
+"""
+
+import argparse
+import asyncio
+import base64
+import time
+from typing import List
+
+from aiohttp import web
+from aiohttp.test_utils import make_mocked_request
+from aiohttp_session import AbstractStorage
+from aiohttp_session.cookie_storage import EncryptedCookieStorage
+from cryptography import fernet
+
+from spotify_party.sessions import CachedEncryptedCookieStorage
+
+
+async def get_cookies(storage: AbstractStorage, users: int) -> List[str]:
+    cookies = []
+    for n in range(users):
+        request = make_mocked_request("GET", "/")
+        session = await storage.new_session()
+        session["sp_user_id"] = f"user{n}"
+        response = web.Response()
+        await storage.save_session(request, response, session)
+        cookies.append(response.cookies[storage.cookie_name].value)
+    return cookies
+
+
+def get_request(storage: AbstractStorage, cookie: str) -> web.Request:
+    return make_mocked_request(
+        "GET", "/", headers={"Cookie": f"{storage.cookie_name}={cookie}"}
+    )
+
+
+async def handle(
+    storage: AbstractStorage, request: web.Request, save: bool
+) -> None:
+    session = await storage.load_session(request)
+    if save:
+        # Like a login by a user who is already logged in
+        session["sp_user_id"] = session["sp_user_id"]
+        await storage.save_session(request, web.Response(), session)
+
+
+async def measure(
+    name: str, storage: AbstractStorage, args: argparse.Namespace
+) -> None:
+    # The mocked requests are expensive to build, so they're reused
+    requests = [
+        get_request(storage, cookie)
+        for cookie in await get_cookies(storage, args.users)
+    ]
+    for save in (False, True):
+        start = time.process_time()
+        for n in range(args.requests):
+            await handle(storage, requests[n % len(requests)], save)
+        elapsed = time.process_time() - start
+        label = f"{name}, {'load and save' if save else 'load'}"
+        print(f"{label:<30}{1e6 * elapsed / args.requests:>12.1f}")
+
+
+async def run(args: argparse.Namespace) -> None:
+    key = base64.urlsafe_b64decode(fernet.Fernet.generate_key())
+    print(f"{'storage':<30}{'CPU µs/req':>12}")
+    await measure("encrypted", EncryptedCookieStorage(key), args)
+    await measure(
+        "cached",
+        CachedEncryptedCookieStorage(key, cache_size=args.users),
+        args,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument(
+        "--users", type=int, default=100, help="distinct session cookies"
+    )
+    args = parser.parse_args()
+    asyncio.run(run(args))
@@ -0,0 +1,110 @@
+"""Measure how long it takes to import the app, and enforce a budget
+
+Usage:
+
+    python benchmarks/startup.py --budget-ms 600
+
+Each import runs in a fresh interpreter and the fastest of ``--repeat`` runs
+is reported, along with the slowest modules for the full server. The script
+exits with an error if the server import goes over the budget, or if any of
+the modules in ``FORBIDDEN`` are imported, so it can be run in CI.
+
+"""
+
+import argparse
+import subprocess
+import sys
+import time
+from typing import List, Tuple
+
+TARGETS = {
+    # What the command line tools and config loading need
+    "package": "import spotify_party",
+    # Everything needed to run the server
+    "server": "import spotify_party.app",
+}
+
+# Slow imports that the app shouldn't need
+FORBIDDEN = ("pkg_resources",)
+
+
+def measure(code: str, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], check=True)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def get_slowest(code: str, count: int) -> List[Tuple[int, str]]:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        fields = line[len("import time:") :].split("|")
+        if not fields[0].strip().isdigit():
+            continue
+        modules.append((int(fields[0]), fields[2].strip()))
+    return sorted(modules, reverse=True)[:count]
+
+
+def get_forbidden(code: str) -> List[str]:
+    check = (
+        f"{code}\nimport sys\n"
+        f"print(' '.join(m for m in {FORBIDDEN!r} if m in sys.modules))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", check],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    return result.stdout.split()
+
+
+def main(args: argparse.Namespace) -> int:
+    baseline = measure("pass", args.repeat)
+    print(f"{'import':<12}{'ms':>10}")
+    timings = {}
+    for name, code in TARGETS.items():
+        timings[name] = measure(code, args.repeat) - baseline
+        print(f"{name:<12}{1000 * timings[name]:>10.1f}")
+
+    print()
+    print(f"{'slowest modules (self)':<40}{'ms':>10}")
+    for us, module in get_slowest(TARGETS["server"], args.top):
+        print(f"{module:<40}{us / 1000:>10.1f}")
+
+    failed = False
+    forbidden = get_forbidden(TARGETS["server"])
+    if forbidden:
+        print(f"\nFAIL: imported {', '.join(forbidden)}")
+        failed = True
+    if 1000 * timings["server"] > args.budget_ms:
+        print(
+            f"\nFAIL: the server import took {1000 * timings['server']:.1f} "
+            f"ms (budget {args.budget_ms:.1f} ms)"
+        )
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument(
+        "--budget-ms",
+        type=float,
+        default=1000.0,
+        help="the maximum time to import the server, on top of the "
+        "interpreter's own startup",
+    )
+    sys.exit(main(parser.parse_args()))
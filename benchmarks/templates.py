@@ -0,0 +1,122 @@
+"""Measure the template startup and render times with and without caching
+
+Usage:
+
+    python benchmarks/templates.py --renders 2000
+
+"""
+
+import argparse
+import tempfile
+import time
+from typing import Any, Callable, Dict, Mapping
+
+import aiohttp_jinja2
+from aiohttp import web
+from cryptography import fernet
+
+from spotify_party import app_factory, compile_templates
+from spotify_party.app import get_template_options
+from spotify_party.config import validate_config
+from spotify_party.stats import RoomStats
+
+TEMPLATES = ("play.html", "listen.html", "admin.room.html")
+
+
+def get_contexts(listeners: int) -> Dict[str, Mapping[str, Any]]:
+    room = RoomStats("host/brave-otter", "host", "The Host")
+    room.listeners = {f"u{n}": f"User {n}" for n in range(listeners)}
+    room.peak = listeners
+    return {
+        "play.html": {
+            "is_logged_in": True,
+            "current_page": "play",
+            "user_id": "host",
+            "room_name": "brave-otter",
+        },
+        "listen.html": {
+            "is_logged_in": True,
+            "user_id": "host",
+            "room_name": "brave-otter",
+        },
+        "admin.room.html": {"room": room},
+    }
+
+
+def get_config(**overrides: Any) -> Mapping[str, Any]:
+    config = dict(
+        spotify_client_id="id",
+        spotify_client_secret="secret",
+        spotify_redirect_uri="http://localhost/spotify/callback",
+        base_url="http://localhost",
+        database_filename=":memory:",
+        session_key=fernet.Fernet.generate_key().decode("utf-8"),
+    )
+    config.update(overrides)
+    return validate_config(config)
+
+
+def timed(func: Callable[[], Any], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def startup(config: Mapping[str, Any]) -> None:
+    # A new worker: a fresh environment that loads each template once
+    env = aiohttp_jinja2.setup(
+        web.Application(), **get_template_options(config)
+    )
+    for name in TEMPLATES:
+        env.get_template(name)
+
+
+def main(args: argparse.Namespace) -> None:
+    contexts = get_contexts(args.listeners)
+
+    print(f"{'startup':<32}{'ms':>10}")
+    with tempfile.TemporaryDirectory() as directory:
+        cached = get_config(template_cache=directory)
+        compile_templates(cached)
+        for label, config in (
+            ("compiled at startup", get_config()),
+            ("from the bytecode cache", cached),
+        ):
+            elapsed = timed(lambda: startup(config), args.repeat)
+            print(f"{label:<32}{1000 * elapsed:>10.2f}")
+
+    print()
+    print(f"{'render (per call)':<32}{'reload us':>12}{'no reload us':>14}")
+    envs = {
+        debug: aiohttp_jinja2.get_env(app_factory(get_config(debug=debug)))
+        for debug in (True, False)
+    }
+    for name in TEMPLATES:
+        results = []
+        for debug in (True, False):
+            env = envs[debug]
+
+            # This is what aiohttp_jinja2.render_template does per request
+            def render() -> None:
+                for _ in range(args.renders):
+                    env.get_template(name).render(contexts[name])
+
+            elapsed = timed(render, args.repeat)
+            results.append(1e6 * elapsed / args.renders)
+        print(f"{name:<32}{results[0]:>12.1f}{results[1]:>14.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--renders", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--listeners",
+        type=int,
+        default=50,
+        help="the number of listeners on the admin room page",
+    )
+    main(parser.parse_args())
@@ -72,7 +72,9 @@ class App extends React.Component<AppProps, AppState> {
   }
 
   connectSocket() {
-    this.socket = io.connect();
+    // Long-polling needs every request of a session to reach the same
+    // worker, so only websockets are used
+    this.socket = io.connect({ transports: ["websocket"] });
     this.socket.on("listeners", (data: any) => {
       this.setState({ listeners: data.number });
     });
@@ -82,6 +84,16 @@ class App extends React.Component<AppProps, AppState> {
         currentTrack: data.playing
       });
     });
+    this.socket.on("playback", (data: any) => {
+      if (data.playing) this.setState({ currentTrack: data.playing });
+      if (
+        this.props.isListener &&
+        this.state.status == Status.Streaming &&
+        (data.changes.includes("seek") || data.changes.includes("pause"))
+      ) {
+        this.sync();
+      }
+    });
     this.socket.on("close", () => {
       this.setState(ReadyState);
     });
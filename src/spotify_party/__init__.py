@@ -1,8 +1,23 @@
-__all__ = ["app_factory", "create_tables", "get_config"]
+__all__ = ["app_factory", "compile_templates", "create_tables", "get_config"]
+
+from typing import Any
 
-from .app import app_factory
 from .config import get_config
-from .db import create_tables
+
+
+def __getattr__(name: str) -> Any:
+    # The server and the database are only imported when they're used, so
+    # that loading the config and the command line tools start quickly
+    if name in ("app_factory", "compile_templates"):
+        from . import app
+
+        return getattr(app, name)
+    if name == "create_tables":
+        from . import db
+
+        return db.create_tables
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 __uri__ = "https://github.com/dfm/spotify-party"
 __author__ = "Daniel Foreman-Mackey"
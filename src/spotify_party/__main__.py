@@ -1,19 +1,46 @@
 import argparse
 
-from aiohttp import web
-
-from spotify_party import app_factory, create_tables, get_config
+from spotify_party import get_config
 
 parser = argparse.ArgumentParser()
 parser.add_argument("config_file", type=str)
 parser.add_argument("--create-tables", action="store_true")
+parser.add_argument(
+    "--compile-templates",
+    action="store_true",
+    help="fill the template bytecode cache and exit",
+)
+parser.add_argument(
+    "--workers",
+    type=int,
+    default=None,
+    help="the number of worker processes (overrides the config file)",
+)
 args = parser.parse_args()
 
 config = get_config(args.config_file)
+workers = config["workers"] if args.workers is None else args.workers
 
 
 if args.create_tables:
+    from spotify_party import create_tables
+
     create_tables(config["database_filename"])
 
+elif args.compile_templates:
+    from spotify_party import compile_templates
+
+    count = compile_templates(config)
+    print(f"compiled {count} templates into {config['template_cache']}")
+
+elif workers > 1:
+    from spotify_party.cluster import run_cluster
+
+    run_cluster(config, workers)
+
 else:
+    from aiohttp import web
+
+    from spotify_party import app_factory
+
     web.run_app(app_factory(config), port=config["port"])
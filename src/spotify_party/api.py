@@ -1,19 +1,42 @@
-__all__ = ["require_auth", "handle_auth", "update_auth", "call_api"]
+__all__ = [
+    "require_auth",
+    "handle_auth",
+    "update_auth",
+    "call_api",
+    "get_age",
+    "get_app",
+]
 
 import time
 from functools import partial, wraps
-from typing import Any, Awaitable, Callable, Optional, Tuple, Union
+from typing import Any, Awaitable, Callable, Mapping, Optional, Tuple, Union
 
 import aiohttp_session
-from aiohttp import web
+from aiohttp import ClientResponseError, web
 from aiohttp_spotify import SpotifyAuth, SpotifyResponse
+from multidict import CIMultiDict, CIMultiDictProxy
 
-from . import db
+from . import db, metrics
+
+# Set on responses that were shared from an earlier call
+CACHE_AGE_HEADER = "X-Cache-Age"
+
+
+def get_app(request: Union[web.Request, web.Application]) -> web.Application:
+    """Get the main app for a request
+
+    The Spotify API can be called from background tasks that don't have a
+    request, so these functions also accept the app itself.
+
+    """
+    if isinstance(request, web.Application):
+        return request
+    return request.app
 
 
 def require_auth(
     original_handler: Optional[
-        Callable[[web.Request, db.User], Awaitable]
+        Callable[[web.Request, "db.User"], Awaitable]
     ] = None,
     *,
     redirect: bool = True,
@@ -32,7 +55,7 @@ def require_auth(
 
 
 def _require_auth(
-    handler: Callable[[web.Request, db.User], Awaitable],
+    handler: Callable[[web.Request, "db.User"], Awaitable],
     *,
     redirect: bool = True,
     admin: bool = False,
@@ -90,51 +113,111 @@ async def handle_auth(request: web.Request, auth: SpotifyAuth) -> None:
 
 
 async def update_auth(
-    request: web.Request, auth: SpotifyAuth
+    request: Union[web.Request, web.Application], user: "db.User"
 ) -> Tuple[bool, SpotifyAuth]:
-    auth_changed = False
-    if auth.expires_at - time.time() <= 600:  # 10 minutes
-        auth_changed = True
-        auth = await request.app["spotify_app"]["spotify_client"].update_auth(
-            request.app["client_session"], auth
+    """Make sure that the user's access token is fresh
+
+    The refresh is handled by the app's :class:`tokens.TokenManager` so
+    concurrent callers share a single request to the token endpoint.
+
+    """
+    auth_changed = await get_app(request)["tokens"].ensure_fresh(user)
+    return auth_changed, user.auth
+
+
+async def send(
+    app: web.Application,
+    user: "db.User",
+    endpoint: str,
+    method: str,
+    kwargs: Mapping[str, Any],
+) -> SpotifyResponse:
+    start = time.monotonic()
+    status = None
+    try:
+        response = await app["scheduler"].request(
+            app["client_session"],
+            app["spotify_app"]["spotify_client"].api_url,
+            user.auth,
+            endpoint,
+            method=method,
+            observe=partial(app["latency"].record, user.user_id),
+            **kwargs,
         )
-    return auth_changed, auth
+        status = response.status
+    except (ClientResponseError, web.HTTPException) as e:
+        status = e.status
+        raise
+    finally:
+        metrics.observe_spotify(endpoint, method, start, status)
+    return response
 
 
 async def call_api(
-    request: web.Request,
-    user: Union[db.User, None],
+    request: Union[web.Request, web.Application],
+    user: Union["db.User", None],
     endpoint: str,
     *,
     method: str = "GET",
+    max_age: Optional[float] = None,
     **kwargs,
 ) -> Union[SpotifyResponse, None]:
     """Call the Spotify API
 
+    Identical GET requests for the same token share one call while it's in
+    flight, and its response for ``spotify_cache_ttl`` seconds after that.
+    Any other method drops the shared responses for the token. The age of a
+    shared response can be read with :func:`get_age`.
+
     Args:
-        request (web.Request): The current request
+        request (Union[web.Request, web.Application]): The current request,
+            or the app when called outside of a request
         user (Union[db.User, None]): The current user (this call will fail
             without one)
         endpoint (str): The API path
         method (str, optional): The HTTP request method. Defaults to "GET".
+        max_age (float, optional): The oldest shared response to accept, in
+            seconds
 
     Returns:
         Union[SpotifyResponse, None]: The response from the API
 
+    Raises:
+        ratelimit.RateLimited: If the call was dropped by the rate limiter
+
     """
     if user is None:
         return None
 
-    response = await request.app["spotify_app"]["spotify_client"].request(
-        request.app["client_session"],
-        user.auth,
-        endpoint,
-        method=method,
-        **kwargs,
-    )
+    app = get_app(request)
+    auth_changed = await app["tokens"].ensure_fresh(user)
+    token = user.auth.access_token
+    responses = app["spotify_responses"]
+    call = partial(send, app, user, endpoint, method, kwargs)
+
+    if method != "GET":
+        # This probably changed the player, so the shared responses (and
+        # the ones in flight) are out of date
+        responses.invalidate_tags(token)
+        try:
+            response = await call()
+        finally:
+            responses.invalidate_tags(token)
+
+    else:
+        key = (token, endpoint, repr(sorted(kwargs.items())))
+        response, received = await responses.get(
+            key, call, tags=(token,), max_age=max_age
+        )
+        age = time.monotonic() - received
+        if age >= 0.001:
+            headers = CIMultiDict(response.headers)
+            headers[CACHE_AGE_HEADER] = f"{age:.3f}"
+            response = response._replace(headers=CIMultiDictProxy(headers))
 
-    # Update the authentication info if required
-    if response.auth_changed:
-        await request.app["db"].update_auth(user, response.auth)
+    return response._replace(auth_changed=auth_changed)
 
-    return response
+
+def get_age(response: SpotifyResponse) -> float:
+    """How long ago a (shared) response was received, in seconds"""
+    return float(response.headers.get(CACHE_AGE_HEADER, 0.0))
@@ -1,69 +1,565 @@
-__all__ = ["app_factory"]
+__all__ = ["app_factory", "compile_templates"]
 
+import asyncio
 import base64
+import logging
+import os
 import pathlib
-from typing import Any, AsyncIterator, Mapping
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Mapping
 
 import aiohttp_jinja2
 import aiohttp_session
 import aiohttp_spotify
 import jinja2
-import pkg_resources
-from aiohttp import ClientSession, web
-from aiohttp_session.cookie_storage import EncryptedCookieStorage
+from aiohttp import web
 
-from . import api, db, interface, views
+from . import (
+    api,
+    cache,
+    db,
+    devices,
+    interface,
+    metrics,
+    poller,
+    pool,
+    ratelimit,
+    resources,
+    sessions,
+    static,
+    stats,
+    sync,
+    tokens,
+    views,
+)
+from .generate_room_name import RoomNameAllocator
 
+logger = logging.getLogger(__name__)
 
-def get_resource_path(path: str) -> pathlib.Path:
-    return pathlib.Path(
-        pkg_resources.resource_filename(__name__, path)
-    ).resolve()
+
+def get_template_options(config: Mapping[str, Any]) -> Dict[str, Any]:
+    """The settings for the Jinja environment
+
+    Outside of debug mode, the templates are never checked for changes and
+    their compiled bytecode is saved to ``template_cache`` (if set) so that
+    new workers don't compile them again.
+
+    """
+    options: Dict[str, Any] = dict(
+        loader=jinja2.FileSystemLoader(resources.get_path("templates")),
+        auto_reload=config["debug"],
+    )
+    if config["template_cache"]:
+        path = pathlib.Path(config["template_cache"])
+        path.mkdir(parents=True, exist_ok=True)
+        options["bytecode_cache"] = jinja2.FileSystemBytecodeCache(str(path))
+    return options
+
+
+def load_templates(env: jinja2.Environment) -> int:
+    names = env.list_templates(extensions=["html"])
+    for name in names:
+        env.get_template(name)
+    return len(names)
+
+
+def compile_templates(config: Mapping[str, Any]) -> int:
+    """Fill the template bytecode cache ahead of time"""
+    if not config["template_cache"]:
+        raise ValueError("'template_cache' must be set to compile templates")
+    # Set up the environment like the app does, since the cached bytecode
+    # depends on the environment's defaults (like autoescaping)
+    env = aiohttp_jinja2.setup(
+        web.Application(), **get_template_options(config)
+    )
+    return load_templates(env)
 
 
 async def client_session(app: web.Application) -> AsyncIterator[None]:
-    """A fixture to create a single ClientSession for the app to use"""
-    async with ClientSession() as session:
+    """A fixture to create a single ClientSession for the app to use
+
+    The connections to the Spotify API and accounts hosts are opened in the
+    background while the app starts.
+
+    """
+    config = app["config"]
+    async with pool.create_session(config, app["pool_stats"]) as session:
         app["client_session"] = session
+        number = config["spotify_warm_connections"]
+        task = asyncio.ensure_future(
+            asyncio.gather(
+                pool.warm_up(session, config["spotify_api_url"], number),
+                pool.warm_up(session, config["spotify_token_url"], 1),
+            )
+        )
         yield
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+
+async def database(app: web.Application) -> AsyncIterator[None]:
+    """A fixture to open and close the database connection pool"""
+    await app["db"].connect()
+    yield
+    await app["db"].close()
+
+
+async def room_names(app: web.Application) -> AsyncIterator[None]:
+    """A fixture to load the names of the open rooms into the allocator"""
+    allocator = app["room_names"]
+    allocator.load(await app["db"].get_room_ids())
+    app["db"].on_mutation.append(allocator.observe)
+    yield
+    app["db"].on_mutation.remove(allocator.observe)
+
+
+async def room_stats(app: web.Application) -> AsyncIterator[None]:
+    """A fixture to load the open rooms into the statistics aggregator"""
+    aggregator = app["stats"]
+    aggregator.load(await app["db"].get_room_members())
+    app["db"].on_mutation.append(aggregator.observe)
+    yield
+    app["db"].on_mutation.remove(aggregator.observe)
+    await aggregator.close()
+
+
+async def pollers(app: web.Application) -> AsyncIterator[None]:
+    """A fixture to poll the open rooms, and stop the tasks on shutdown
+
+    The rooms are picked up again after a restart of the primary worker.
+
+    """
+    if app["primary"]:
+        for user_id, _, _, playing_to in await app["db"].get_room_members():
+            if playing_to is not None:
+                app["pollers"].start(playing_to, user_id)
+    yield
+    await app["pollers"].close()
+
+
+async def token_refresh(app: web.Application) -> AsyncIterator[None]:
+    """A fixture to refresh the active users' tokens in the background"""
+    task = asyncio.ensure_future(app["tokens"].run())
+    yield
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+
+
+async def message_queue(app: web.Application) -> AsyncIterator[None]:
+    """A fixture to connect to the broker shared by the worker processes
+
+    Besides the socket.io events, the broker carries the database cache
+    invalidations so that no worker serves rows that another one changed,
+    the database mutation events, and the other workers' commands to the
+    pollers, which only run in the primary worker, along with the snapshots
+    of the playback that these poll.
+
+    """
+    client = app["broker"]
+    await client.connect()
+
+    cache = app["db"].cache
+    queue = client.subscribe("cache")
+
+    async def invalidate() -> None:
+        while True:
+            tags = await queue.get()
+            cache.invalidate_tags(*tags)
+            interface.connections.invalidate(tags)
+
+    def publish(tags: tuple) -> None:
+        client.publish_nowait("cache", tags)
+
+    # The other workers' mutation events are replayed to our observers; the
+    # broker echoes messages back to their sender, so those are skipped
+    mutations = client.subscribe("mutations")
+    origin = os.getpid()
+
+    async def replay() -> None:
+        while True:
+            sender, event, args = await mutations.get()
+            if sender != origin:
+                app["db"].notify(event, args, exclude=relay)
+
+    def relay(event: str, args: tuple) -> None:
+        client.publish_nowait("mutations", (origin, event, args))
+
+    tasks = [
+        asyncio.ensure_future(invalidate()),
+        asyncio.ensure_future(replay()),
+    ]
+
+    pollers = app["pollers"]
+    if app["primary"]:
+        commands = client.subscribe("pollers")
+
+        async def run_commands() -> None:
+            while True:
+                command, args = await commands.get()
+                try:
+                    await pollers.handle(command, args)
+                except Exception:
+                    logger.exception(f"failed to {command} a poller")
+
+        def publish_snapshot(snapshot: tuple) -> None:
+            client.publish_nowait("playback", snapshot)
+
+        tasks.append(asyncio.ensure_future(run_commands()))
+        pollers.publish = publish_snapshot
+    else:
+        snapshots = client.subscribe("playback")
+
+        async def update() -> None:
+            while True:
+                pollers.update(*await snapshots.get())
+
+        def forward(command: str, args: tuple) -> None:
+            client.publish_nowait("pollers", (command, args))
+
+        tasks.append(asyncio.ensure_future(update()))
+        pollers.forward = forward
+
+    app["db"].on_invalidate.append(publish)
+    app["db"].on_mutation.append(relay)
+    yield
+    pollers.forward = None
+    pollers.publish = None
+    app["db"].on_mutation.remove(relay)
+    app["db"].on_invalidate.remove(publish)
+    for task in tasks:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    await client.close()
+
+
+@web.middleware
+async def websocket_only(
+    request: web.Request, handler: Callable[[web.Request], Awaitable]
+) -> web.StreamResponse:
+    """Refuse socket.io's long-polling transport
+
+    The requests of a long-polling session must all reach the worker that
+    holds the session, which the shared listening socket doesn't ensure.
+
+    """
+    if (
+        request.path.startswith("/socket.io/")
+        and request.query.get("transport") == "polling"
+    ):
+        raise web.HTTPBadRequest(text="Only websockets are supported")
+    return await handler(request)
+
+
+def setup_message_queue(app: web.Application, url: str) -> None:
+    """Share socket.io events with the other processes through ``url``
+
+    ``unix://`` URLs point at the broker started by ``--workers`` and
+    ``redis://`` URLs use Redis (this requires the ``aioredis`` package).
+    The sockets must then connect with the websocket transport.
+
+    """
+    # Ahead of the error pages, since this answers the socket.io client
+    app.middlewares.insert(0, websocket_only)
+    if url.startswith("unix://"):
+        from . import broker
+
+        app["broker"] = broker.BrokerClient(url)
+        app.cleanup_ctx.append(message_queue)
+        manager = broker.LocalPubSubManager(app["broker"])
+    elif url.startswith("redis://"):
+        import socketio
 
+        manager = socketio.AsyncRedisManager(url)
+    else:
+        raise ValueError(f"unsupported message queue '{url}'")
 
-def app_factory(config: Mapping[str, Any]) -> web.Application:
-    app = web.Application(middlewares=[views.error_middleware])
+    # The manager is initialized lazily on the first connection
+    interface.sio.manager = manager
+    interface.sio.manager_initialized = False
+    manager.set_server(interface.sio)
+
+
+async def warm_templates(app: web.Application) -> None:
+    load_templates(aiohttp_jinja2.get_env(app))
+
+
+async def load_static(app: web.Application) -> None:
+    app["assets"].load()
+    views.render_pages(app)
+
+
+async def listener_broadcasts(app: web.Application) -> AsyncIterator[None]:
+    """A fixture to drop the pending listener counts on shutdown"""
+    yield
+    await app["listener_broadcasts"].close()
+
+
+def register_metrics(app: web.Application) -> None:
+    registry = metrics.registry
+    registry.collector(
+        "database_cache_total",
+        "The number of database cache lookups",
+        lambda: {
+            ("hit",): app["db"].cache.hits,
+            ("miss",): app["db"].cache.misses,
+        },
+        labels=("result",),
+        type="counter",
+    )
+    registry.collector(
+        "session_cache_total",
+        "The number of session cookie lookups in the decoded session cache, "
+        "and the unchanged sessions that weren't saved again",
+        lambda: {
+            ("hit",): app["sessions"].cache.hits,
+            ("miss",): app["sessions"].cache.misses,
+            ("unchanged",): app["sessions"].unchanged,
+        },
+        labels=("result",),
+        type="counter",
+    )
+    registry.collector(
+        "database_commits_total",
+        "The number of database transactions and the write batches in them",
+        lambda: {
+            ("commits",): app["db"].commits,
+            ("batches",): app["db"].batches,
+        },
+        labels=("kind",),
+        type="counter",
+    )
+    registry.collector(
+        "spotify_scheduler_total",
+        "The number of Spotify API calls that were throttled, retried or "
+        "dropped by the rate limiter",
+        lambda: {
+            (name,): value for name, value in app["scheduler"].stats().items()
+        },
+        labels=("outcome",),
+        type="counter",
+    )
+    registry.collector(
+        "spotify_cache_total",
+        "The number of Spotify API reads that were served from a recent "
+        "response, shared a call in flight, or made a new call",
+        lambda: {
+            ("hit",): app["spotify_responses"].hits,
+            ("coalesced",): app["spotify_responses"].coalesced,
+            ("miss",): app["spotify_responses"].misses,
+        },
+        labels=("result",),
+        type="counter",
+    )
+    registry.collector(
+        "spotify_connections",
+        "The number of requests to each Spotify host that are in flight or "
+        "waiting for a free connection",
+        lambda: app["pool_stats"].gauges(),
+        labels=("host", "state"),
+    )
+    registry.collector(
+        "spotify_connections_total",
+        "The number of connections to each Spotify host that were opened, "
+        "reused from the pool, or waited for",
+        lambda: app["pool_stats"].totals,
+        labels=("host", "outcome"),
+        type="counter",
+    )
+    registry.collector(
+        "token_refreshes_total",
+        "The number of access token refreshes",
+        lambda: {
+            ("refreshed",): app["tokens"].refreshes,
+            ("coalesced",): app["tokens"].coalesced,
+        },
+        labels=("outcome",),
+        type="counter",
+    )
+    registry.collector(
+        "device_transfers_skipped_total",
+        "The number of transfers skipped because the device was active",
+        lambda: app["devices"].skipped,
+        type="counter",
+    )
+    registry.collector(
+        "listeners_broadcasts_total",
+        "The number of listener count events sent to rooms, and the number "
+        "saved by coalescing membership changes",
+        lambda: {
+            ("sent",): app["listener_broadcasts"].sent,
+            ("saved",): app["listener_broadcasts"].saved,
+        },
+        labels=("outcome",),
+        type="counter",
+    )
+    registry.collector(
+        "socket_connections",
+        "The number of socket.io connections to this process",
+        lambda: len(interface.connections),
+    )
+    registry.collector(
+        "room_names",
+        "The number of room names in use or held for new rooms, out of "
+        "the names that can currently be offered",
+        lambda: {
+            ("in_use",): len(app["room_names"].in_use),
+            ("held",): len(app["room_names"].held),
+            ("size",): app["room_names"].size,
+        },
+        labels=("state",),
+    )
+    registry.collector(
+        "rooms",
+        "The number of open rooms and of their listeners",
+        lambda: {
+            ("rooms",): len(app["stats"]),
+            ("listeners",): app["stats"].listener_count,
+        },
+        labels=("kind",),
+    )
+    registry.collector(
+        "room_pollers",
+        "The number of rooms polled by this process",
+        lambda: len(app["pollers"]),
+    )
+
+
+def app_factory(
+    config: Mapping[str, Any], *, primary: bool = True
+) -> web.Application:
+    """The app for one worker
+
+    Args:
+        primary (bool, optional): Whether this worker runs the background
+            tasks that are shared by all the workers: the token refreshes
+            and the room pollers
+
+    """
+    app = web.Application(
+        middlewares=[metrics.middleware, views.error_middleware]
+    )
 
     # load the configuration file
     app["config"] = config
+    app["primary"] = primary
 
     # Add the client session for pooling outgoing connections
+    app["pool_stats"] = pool.PoolStats()
     app.cleanup_ctx.append(client_session)
 
     # Connect the database and set up a map of websockets
-    app["db"] = db.Database(config["database_filename"])
+    app["db"] = db.Database(
+        config["database_filename"],
+        pool_size=config["database_pool_size"],
+        busy_timeout=config["database_busy_timeout"],
+        cache_size=config["cache_size"],
+        cache_ttl=config["cache_ttl"],
+        commit_delay=config["database_commit_delay"],
+    )
+    app.cleanup_ctx.append(database)
+
+    # New rooms are offered names that no open room is using
+    app["room_names"] = RoomNameAllocator()
+    app.cleanup_ctx.append(room_names)
+
+    # The admin pages and dashboards read the rooms from memory
+    app["stats"] = stats.StatsAggregator(
+        emit=interface.sio.emit, delay=config["stats_broadcast_delay"]
+    )
+    app.cleanup_ctx.append(room_stats)
+
+    # Reconnecting sockets are recognized until their user's row changes
+    app["db"].on_invalidate.append(interface.connections.invalidate)
+
+    # Each active room polls its host's playback in the background
+    app["pollers"] = poller.PollerRegistry(
+        app,
+        emit=interface.sio.emit,
+        min_interval=config["poll_min_interval"],
+        max_interval=config["poll_max_interval"],
+    )
+    app.cleanup_ctx.append(pollers)
+
+    # Changes in room membership are announced in batches
+    app["listener_broadcasts"] = interface.ListenerBroadcaster(
+        app, delay=config["listeners_broadcast_delay"]
+    )
+    app.cleanup_ctx.append(listener_broadcasts)
+
+    # Access tokens are refreshed once per user, ahead of time
+    app["tokens"] = tokens.TokenManager(
+        app,
+        refresh_margin=config["token_refresh_margin"],
+        interval=config["token_refresh_interval"],
+    )
+    if primary:
+        app.cleanup_ctx.append(token_refresh)
+
+    # Calls to the Spotify API are scheduled within the rate limits
+    app["scheduler"] = ratelimit.RequestScheduler(
+        rate=config["spotify_rate_limit"],
+        token_rate=config["spotify_token_rate_limit"],
+        max_retries=config["spotify_max_retries"],
+        max_wait=config["spotify_max_wait"],
+    )
+
+    # Identical reads of a player share a call and its response, briefly
+    app["spotify_responses"] = cache.SingleFlightCache(
+        maxsize=config["cache_size"], ttl=config["spotify_cache_ttl"]
+    )
+
+    # Round trip times to the API, for latency-compensated syncing
+    app["latency"] = sync.LatencyTracker()
+
+    # Transfers wait for the devices to become active and skip the devices
+    # that already are
+    app["devices"] = devices.DeviceTracker(
+        timeout=config["device_ready_timeout"], ttl=config["device_active_ttl"]
+    )
 
     # And the routes for the main app
     app.add_routes(views.routes)
     app.add_routes(interface.routes)
 
-    # Set up the user session for cookies
-    aiohttp_session.setup(
-        app,
-        EncryptedCookieStorage(
-            base64.urlsafe_b64decode(app["config"]["session_key"])
-        ),
+    # Set up the user session for cookies, decrypting each cookie once
+    app["sessions"] = sessions.CachedEncryptedCookieStorage(
+        base64.urlsafe_b64decode(app["config"]["session_key"]),
+        cache_size=config["cache_size"],
+        cache_ttl=config["session_cache_ttl"],
     )
+    aiohttp_session.setup(app, app["sessions"])
 
     # Set up the templating engine and the static endpoint
-    aiohttp_jinja2.setup(
-        app, loader=jinja2.FileSystemLoader(get_resource_path("templates"))
-    )
+    aiohttp_jinja2.setup(app, **get_template_options(config))
     app["static_root_url"] = "/assets"
-    app.router.add_static("/assets", get_resource_path("assets"))
+    if config["debug"]:
+        app.router.add_static("/assets", resources.get_path("assets"))
+    else:
+        # Serve fingerprinted, compressed assets and pages from memory
+        app["assets"] = static.AssetManifest(
+            resources.get_path("assets"), prefix=app["static_root_url"]
+        )
+        app.router.add_get("/assets/{filename:.+}", app["assets"].handle)
+        aiohttp_jinja2.get_env(app).globals["static"] = app["assets"].url
+        app.on_startup.append(warm_templates)
+        app.on_startup.append(load_static)
 
     # Set up the Spotify app to instigate the OAuth flow
     app["spotify_app"] = aiohttp_spotify.spotify_app(
         client_id=config["spotify_client_id"],
         client_secret=config["spotify_client_secret"],
         redirect_uri=config["spotify_redirect_uri"],
+        auth_url=config["spotify_auth_url"],
+        token_url=config["spotify_token_url"],
+        api_url=config["spotify_api_url"],
         handle_auth=api.handle_auth,
         default_redirect=app.router["play"].url_for(),
         scope=[
@@ -78,7 +574,12 @@ def app_factory(config: Mapping[str, Any]) -> web.Application:
     app["spotify_app"]["main_app"] = app
     app.add_subapp("/spotify", app["spotify_app"])
 
+    # Export the internal counters along with the request metrics
+    register_metrics(app)
+
     # Attach the socket.io interface
+    if config["message_queue"]:
+        setup_message_queue(app, config["message_queue"])
     interface.sio.attach(app)
 
     return app
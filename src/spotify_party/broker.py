@@ -0,0 +1,136 @@
+__all__ = ["serve", "BrokerClient", "LocalPubSubManager"]
+
+import asyncio
+import logging
+import os
+import pickle
+from typing import Any, Dict, Optional, Set
+
+from socketio.asyncio_pubsub_manager import AsyncPubSubManager
+
+logger = logging.getLogger(__name__)
+
+
+def get_path(url: str) -> str:
+    if not url.startswith("unix://"):
+        raise ValueError(f"invalid broker URL '{url}'")
+    return url[len("unix://") :]
+
+
+async def serve(url: str) -> None:
+    """Run a broker that copies every message to every connected worker
+
+    Each message is framed by its length as a 4 byte big-endian integer.
+    The broker doesn't look inside the messages.
+
+    """
+    path = get_path(url)
+    clients: Set[asyncio.StreamWriter] = set()
+
+    async def handle(
+        reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        clients.add(writer)
+        try:
+            while True:
+                header = await reader.readexactly(4)
+                payload = await reader.readexactly(
+                    int.from_bytes(header, "big")
+                )
+                for client in list(clients):
+                    client.write(header + payload)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            clients.discard(writer)
+            writer.close()
+
+    if os.path.exists(path):
+        os.unlink(path)
+    server = await asyncio.start_unix_server(handle, path)
+    os.chmod(path, 0o600)
+    async with server:
+        await server.serve_forever()
+
+
+class BrokerClient:
+    """A worker's connection to the broker started by :func:`serve`
+
+    Messages are published to named channels and each channel that this
+    worker subscribes to is delivered to its own queue.
+
+    """
+
+    def __init__(self, url: str):
+        self.path = get_path(url)
+        self.queues: Dict[str, asyncio.Queue] = {}
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._task: Optional[asyncio.Future] = None
+
+    async def connect(self) -> None:
+        reader, self._writer = await asyncio.open_unix_connection(self.path)
+        self._task = asyncio.ensure_future(self._read(reader))
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def subscribe(self, channel: str) -> asyncio.Queue:
+        if channel not in self.queues:
+            self.queues[channel] = asyncio.Queue()
+        return self.queues[channel]
+
+    def publish_nowait(self, channel: str, data: Any) -> None:
+        if self._writer is None:
+            raise RuntimeError("the broker is not connected")
+        payload = pickle.dumps((channel, data))
+        self._writer.write(len(payload).to_bytes(4, "big") + payload)
+
+    async def publish(self, channel: str, data: Any) -> None:
+        self.publish_nowait(channel, data)
+        await self._writer.drain()
+
+    async def _read(self, reader: asyncio.StreamReader) -> None:
+        try:
+            while True:
+                header = await reader.readexactly(4)
+                payload = await reader.readexactly(
+                    int.from_bytes(header, "big")
+                )
+                channel, data = pickle.loads(payload)
+                queue = self.queues.get(channel)
+                if queue is not None:
+                    queue.put_nowait(data)
+        except asyncio.IncompleteReadError:
+            logger.error("lost the connection to the broker")
+
+
+class LocalPubSubManager(AsyncPubSubManager):
+    """A socket.io client manager that shares events through the broker"""
+
+    name = "local"
+
+    def __init__(
+        self,
+        client: BrokerClient,
+        channel: str = "socketio",
+        write_only: bool = False,
+        logger: Optional[logging.Logger] = None,
+    ):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.client = client
+        self.queue = client.subscribe(channel)
+
+    async def _publish(self, data: Any) -> None:
+        await self.client.publish(self.channel, data)
+
+    async def _listen(self) -> Any:
+        return await self.queue.get()
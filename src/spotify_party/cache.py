@@ -0,0 +1,211 @@
+__all__ = ["LRUCache", "SingleFlightCache"]
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Hashable,
+    Iterable,
+    Optional,
+    Set,
+    Tuple,
+)
+
+
+class LRUCache:
+    """A bounded least-recently-used cache where entries expire after a TTL
+
+    Each entry can be labeled with tags, and :func:`LRUCache.invalidate_tags`
+    drops every entry with a given tag. The ``version`` counter is bumped on
+    every invalidation so that a value computed before an invalidation can be
+    refused by :func:`LRUCache.set`.
+
+    Args:
+        maxsize (int, optional): The maximum number of entries
+        ttl (float, optional): The lifetime of an entry in seconds
+
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 5.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.version = 0
+        self._data: "OrderedDict[Hashable, Tuple[float, Any, Tuple]]" = (
+            OrderedDict()
+        )
+        self._tags: Dict[Hashable, Set[Hashable]] = {}
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        entry = self._data.get(key)
+        return entry is not None and entry[0] > time.monotonic()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.get(key)
+        if entry is not None and entry[0] <= time.monotonic():
+            self._discard(key)
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(
+        self,
+        key: Hashable,
+        value: Any,
+        *,
+        tags: Iterable[Hashable] = (),
+        version: Optional[int] = None,
+    ) -> None:
+        if self.maxsize <= 0 or self.ttl <= 0:
+            return
+        if version is not None and version != self.version:
+            return
+        self._discard(key)
+        tags = tuple(tags)
+        self._data[key] = (time.monotonic() + self.ttl, value, tags)
+        for tag in tags:
+            self._tags.setdefault(tag, set()).add(key)
+        while len(self._data) > self.maxsize:
+            self._discard(next(iter(self._data)))
+
+    def invalidate(self, *keys: Hashable) -> None:
+        self.version += 1
+        for key in keys:
+            self._discard(key)
+
+    def invalidate_tags(self, *tags: Hashable) -> None:
+        self.version += 1
+        for tag in tags:
+            for key in self._tags.pop(tag, ()):
+                self._discard(key)
+
+    def prune(self) -> None:
+        """Drop the expired entries, which still count towards the size"""
+        now = time.monotonic()
+        for key in [k for k, v in self._data.items() if v[0] <= now]:
+            self._discard(key)
+
+    def clear(self) -> None:
+        self.version += 1
+        self._data.clear()
+        self._tags.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return dict(hits=self.hits, misses=self.misses, size=len(self))
+
+    def _discard(self, key: Hashable) -> None:
+        entry = self._data.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry[2]:
+            keys = self._tags.get(tag)
+            if keys is None:
+                continue
+            keys.discard(key)
+            if not keys:
+                del self._tags[tag]
+
+
+class SingleFlightCache:
+    """Share the result of concurrent calls with the same key, briefly
+
+    A caller that arrives while a call with the same key is in flight waits
+    for that call instead of making its own, and the result is then kept for
+    ``ttl`` seconds. Invalidating a tag drops the cached results with that
+    tag, and also the calls in flight with it, since their results might
+    predate the change.
+
+    Args:
+        maxsize (int, optional): The maximum number of cached results
+        ttl (float, optional): The lifetime of a result in seconds (if zero,
+            only the calls in flight are shared)
+
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 0.25):
+        self.cache = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.hits = 0
+        self.coalesced = 0
+        self.misses = 0
+        self._inflight: Dict[Hashable, Tuple[asyncio.Future, Tuple]] = {}
+
+    async def get(
+        self,
+        key: Hashable,
+        func: Callable[[], Awaitable[Any]],
+        *,
+        tags: Iterable[Hashable] = (),
+        max_age: Optional[float] = None,
+    ) -> Tuple[Any, float]:
+        """Get the result of ``func`` and the (monotonic) time it arrived
+
+        A cached result older than ``max_age`` seconds isn't used, but a call
+        in flight always is.
+
+        """
+        while True:
+            result = self.cache.get(key)
+            if result is not None and (
+                max_age is None or time.monotonic() - result[1] <= max_age
+            ):
+                self.hits += 1
+                return result
+
+            inflight = self._inflight.get(key)
+            if inflight is None:
+                break
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(inflight[0])
+            except asyncio.CancelledError:
+                # Unless it's the call that was cancelled, not this caller,
+                # in which case this caller tries again
+                if not inflight[0].cancelled():
+                    raise
+
+        self.misses += 1
+        tags = tuple(tags)
+        future = asyncio.get_event_loop().create_future()
+        self._inflight[key] = (future, tags)
+        try:
+            result = (await func(), time.monotonic())
+        except Exception as e:
+            future.set_exception(e)
+            # Only the waiters (if any) need to see this
+            future.exception()
+            raise
+        except BaseException:
+            # A cancellation or an interrupt belongs to this caller alone
+            future.cancel()
+            raise
+        else:
+            future.set_result(result)
+            if self._inflight.get(key, (None,))[0] is future:
+                self.cache.set(key, result, tags=tags)
+            return result
+        finally:
+            if self._inflight.get(key, (None,))[0] is future:
+                del self._inflight[key]
+
+    def invalidate_tags(self, *tags: Hashable) -> None:
+        self.cache.invalidate_tags(*tags)
+        for key, (_, key_tags) in list(self._inflight.items()):
+            if any(tag in key_tags for tag in tags):
+                del self._inflight[key]
+
+    def stats(self) -> Dict[str, int]:
+        return dict(
+            hits=self.hits, coalesced=self.coalesced, misses=self.misses
+        )
@@ -0,0 +1,128 @@
+__all__ = ["run_cluster"]
+
+import asyncio
+import multiprocessing
+import multiprocessing.connection
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+from typing import Any, Mapping
+
+from aiohttp import web
+
+from . import broker, metrics
+from .app import app_factory, compile_templates
+
+
+async def serve_worker(
+    config: Mapping[str, Any], sock: socket.socket, index: int
+) -> None:
+    # Each worker has its own metrics
+    metrics.registry.labels["worker"] = str(index)
+    runner = web.AppRunner(app_factory(config, primary=index == 0))
+    await runner.setup()
+    await web.SockSite(runner, sock).start()
+
+    stopped = asyncio.Event()
+    asyncio.get_event_loop().add_signal_handler(signal.SIGTERM, stopped.set)
+    await stopped.wait()
+    await runner.cleanup()
+
+
+def run_worker(
+    config: Mapping[str, Any], sock: socket.socket, index: int
+) -> None:
+    # CTRL+C reaches the whole process group, but only the parent should act
+    # on it; it stops the workers with SIGTERM so that they shut down once
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(serve_worker(config, sock, index))
+
+
+def run_broker(url: str) -> None:
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(broker.serve(url))
+
+
+def run_cluster(config: Mapping[str, Any], workers: int) -> None:
+    """Run the app in ``workers`` processes that share one listening socket
+
+    Unless ``message_queue`` is configured, a broker process is started on a
+    local socket to share the socket.io events and the database cache
+    invalidations between the workers. The first worker is the primary one,
+    which refreshes the tokens and polls the rooms for all of them. A worker
+    that exits is started again, in the same role.
+
+    """
+    context = multiprocessing.get_context("fork")
+    processes = []
+
+    config = dict(config)
+    broker_process = None
+    if not config["message_queue"]:
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, "broker.sock")
+        config["message_queue"] = f"unix://{path}"
+        broker_process = context.Process(
+            target=run_broker, args=(config["message_queue"],), daemon=True
+        )
+        broker_process.start()
+        while not os.path.exists(path):
+            if not broker_process.is_alive():
+                raise RuntimeError("the message broker failed to start")
+            broker_process.join(0.05)
+
+    # Compile the templates once for all of the workers
+    if config["template_cache"]:
+        compile_templates(config)
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(("0.0.0.0", config["port"]))
+    sock.listen(128)
+    sock.set_inheritable(True)
+    print(f"======== Running on http://0.0.0.0:{config['port']} ========")
+    print(f"({workers} workers; press CTRL+C to quit)")
+
+    def start_worker(index: int) -> multiprocessing.Process:
+        process = context.Process(
+            target=run_worker, args=(config, sock, index)
+        )
+        process.start()
+        return process
+
+    for index in range(workers):
+        processes.append(start_worker(index))
+
+    try:
+        while True:
+            multiprocessing.connection.wait(
+                [process.sentinel for process in processes]
+            )
+            for index, process in enumerate(processes):
+                if process.exitcode is None:
+                    continue
+                print(
+                    f"worker {process.pid} exited with code "
+                    f"{process.exitcode}, restarting it",
+                    file=sys.stderr,
+                )
+                processes[index] = start_worker(index)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        for process in processes:
+            process.join(10)
+            if process.is_alive():
+                process.kill()
+        if broker_process is not None:
+            broker_process.terminate()
+            broker_process.join()
+            shutil.rmtree(directory, ignore_errors=True)
+        sock.close()
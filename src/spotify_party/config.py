@@ -3,17 +3,57 @@ __all__ = ["get_config"]
 from typing import Any, Mapping, MutableMapping
 
 import toml
-from cryptography import fernet
+
+
+def generate_session_key() -> str:
+    from cryptography import fernet
+
+    return fernet.Fernet.generate_key().decode("utf-8")
+
 
 schema: Mapping[str, Any] = dict(
     spotify_client_id=(str, None),
     spotify_client_secret=(str, None),
     spotify_redirect_uri=(str, None),
+    spotify_auth_url=(str, "https://accounts.spotify.com/authorize"),
+    spotify_token_url=(str, "https://accounts.spotify.com/api/token"),
+    spotify_api_url=(str, "https://api.spotify.com/v1"),
     base_url=(str, None),
     database_filename=(str, None),
     port=(int, 5000),
+    debug=(bool, False),
+    template_cache=(str, ""),
+    workers=(int, 1),
+    message_queue=(str, ""),
+    database_pool_size=(int, 4),
+    database_busy_timeout=(float, 5.0),
+    database_commit_delay=(float, 0.002),
+    cache_size=(int, 1024),
+    cache_ttl=(float, 5.0),
+    session_cache_ttl=(float, 300.0),
+    fanout_concurrency=(int, 20),
+    sync_tolerance=(float, 0.25),
+    device_ready_timeout=(float, 5.0),
+    device_active_ttl=(float, 30.0),
+    listeners_broadcast_delay=(float, 0.5),
+    stats_broadcast_delay=(float, 1.0),
+    poll_min_interval=(float, 1.0),
+    poll_max_interval=(float, 10.0),
+    token_refresh_margin=(float, 600.0),
+    token_refresh_interval=(float, 60.0),
+    spotify_rate_limit=(float, 0.0),
+    spotify_token_rate_limit=(float, 5.0),
+    spotify_max_retries=(int, 3),
+    spotify_max_wait=(float, 10.0),
+    spotify_cache_ttl=(float, 0.25),
+    spotify_pool_size=(int, 100),
+    spotify_pool_size_per_host=(int, 0),
+    spotify_keepalive_timeout=(float, 30.0),
+    spotify_dns_cache_ttl=(int, 300),
+    spotify_warm_connections=(int, 4),
     admins=(list, []),
-    session_key=(str, fernet.Fernet.generate_key().decode("utf-8")),
+    # Callable defaults are only evaluated when the value is missing
+    session_key=(str, generate_session_key),
 )
 
 
@@ -25,6 +65,8 @@ def validate_config(config: MutableMapping[str, Any]) -> Mapping[str, Any]:
     new_config = dict()
     for name, (converter, default) in schema.items():
         value = config.pop(name, default)
+        if value is default and callable(default):
+            value = default()
         if value is None:
             raise ValidationError(f"missing value for '{name}'")
         try:
@@ -0,0 +1,97 @@
+__all__ = ["ConnectionRegistry"]
+
+from typing import Dict, Optional, Set, Tuple, Union
+
+from . import cache
+
+
+class ConnectionRegistry:
+    """The socket.io connections of this process, by user and by room
+
+    The registry also remembers which user and room each session cookie
+    belongs to, so that a client that reconnects can be identified without
+    decrypting its session or reading the database. These entries are
+    tagged with the user so that database writes can invalidate them.
+
+    Args:
+        cache_size (int, optional): The number of session cookies remembered
+        ttl (float, optional): How long a session cookie is remembered, in
+            seconds
+
+    """
+
+    def __init__(self, *, cache_size: int = 4096, ttl: float = 600.0):
+        self.sessions = cache.LRUCache(maxsize=cache_size, ttl=ttl)
+        self.user_ids: Dict[str, str] = {}
+        self.sockets: Dict[str, Set[str]] = {}
+        self.rooms: Dict[str, Set[str]] = {}
+        self.joined: Dict[str, Set[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self.user_ids)
+
+    def lookup(self, cookie: Optional[str]) -> Optional[Tuple[str, str]]:
+        """The user ID and room ID remembered for a session cookie"""
+        if cookie is None:
+            return None
+        return self.sessions.get(cookie)
+
+    def remember(
+        self, cookie: Optional[str], user_id: str, room_id: Union[str, None]
+    ) -> None:
+        if cookie is None:
+            return
+        tags = [("user", user_id)]
+        if room_id is not None:
+            tags.append(("room", room_id))
+        self.sessions.set(cookie, (user_id, room_id), tags=tags)
+
+    def invalidate(self, tags: Tuple) -> None:
+        self.sessions.invalidate_tags(*tags)
+
+    def connect(self, sid: str, user_id: str) -> None:
+        self.user_ids[sid] = user_id
+        self.sockets.setdefault(user_id, set()).add(sid)
+        self.joined[sid] = set()
+
+    def disconnect(self, sid: str) -> None:
+        user_id = self.user_ids.pop(sid, None)
+        if user_id is not None:
+            sids = self.sockets.get(user_id, set())
+            sids.discard(sid)
+            if not sids:
+                self.sockets.pop(user_id, None)
+        for room_id in self.joined.pop(sid, set()):
+            self._discard(room_id, sid)
+
+    def join(self, sid: str, room_id: str) -> None:
+        if sid not in self.joined:
+            return
+        self.joined[sid].add(room_id)
+        self.rooms.setdefault(room_id, set()).add(sid)
+
+    def leave(self, sid: str, room_id: str) -> None:
+        if sid not in self.joined:
+            return
+        self.joined[sid].discard(room_id)
+        self._discard(room_id, sid)
+
+    def _discard(self, room_id: str, sid: str) -> None:
+        sids = self.rooms.get(room_id, set())
+        sids.discard(sid)
+        if not sids:
+            self.rooms.pop(room_id, None)
+
+    def get_user_id(self, sid: str) -> Optional[str]:
+        return self.user_ids.get(sid)
+
+    def get_sids(self, user_id: str) -> Set[str]:
+        """The IDs of a user's open sockets"""
+        return set(self.sockets.get(user_id, ()))
+
+    def get_rooms(self, sid: str) -> Set[str]:
+        """The rooms that a socket has joined, besides its own"""
+        return set(self.joined.get(sid, ()))
+
+    def counts(self) -> Dict[str, int]:
+        return {room_id: len(sids) for room_id, sids in self.rooms.items()}
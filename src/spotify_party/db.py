@@ -1,69 +1,150 @@
 __all__ = ["create_tables", "User", "Room", "Database"]
 
 import asyncio
+import logging
 import pathlib
+import re
 import sqlite3
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
 from typing import (
     Any,
+    AsyncIterator,
+    Callable,
     Dict,
     Iterable,
     List,
     Mapping,
     MutableMapping,
     Optional,
+    Sequence,
+    Set,
+    Tuple,
     Union,
 )
 
 import aiosqlite
-import pkg_resources
 from aiohttp import ClientResponseError, web
 from aiohttp_spotify import SpotifyAuth
 
-from . import api
-from .generate_room_name import generate_room_name
+from . import api, cache, fanout, metrics, resources, sync
+
+logger = logging.getLogger(__name__)
 
 DEFAULT_RETRIES = 3
+STATEMENT_CACHE_SIZE = 256
+LISTENER_PAGE_SIZE = 500
+
+_MISSING = object()
+
+# The columns of the users table, in the order that User expects them
+USER_COLUMNS = (
+    "user_id",
+    "display_name",
+    "access_token",
+    "refresh_token",
+    "expires_at",
+    "listening_to",
+    "playing_to",
+    "paused",
+    "device_id",
+)
+SELECT_USERS = f"SELECT {', '.join(USER_COLUMNS)} FROM users"
+
+
+def get_migrations() -> Sequence[Tuple[int, str]]:
+    """Get the schema migrations as a sorted list of (version, filename)"""
+    migrations = []
+    for path in resources.get_path("migrations").iterdir():
+        name = path.name
+        match = re.match(r"^(\d+)_.*\.sql$", name)
+        if match is not None:
+            migrations.append((int(match.group(1)), f"migrations/{name}"))
+    return sorted(migrations)
+
+
+SCHEMA_VERSION = get_migrations()[-1][0]
+
+
+def get_schema_version(connection: sqlite3.Connection) -> int:
+    version = connection.execute("PRAGMA user_version").fetchone()[0]
+    if (
+        version == 0
+        and connection.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='users'"
+        ).fetchone()
+    ):
+        # This database was created before the schema was versioned
+        version = 1
+    return version
+
+
+def timed(name: str) -> Any:
+    return metrics.timed(metrics.database_query_duration, query=name)
 
 
 def create_tables(filename: Union[str, pathlib.Path]) -> None:
-    with open(
-        pkg_resources.resource_filename(__name__, "schema.sql"), "r"
-    ) as f:
-        schema = f.read()
+    """Create the tables or upgrade them to the latest schema version"""
     with sqlite3.connect(filename) as connection:
-        connection.executescript(schema)
+        version = get_schema_version(connection)
+        for number, path in get_migrations():
+            if number <= version:
+                continue
+            script = resources.read_text(path)
+            connection.executescript(
+                f"BEGIN;\n{script}\nPRAGMA user_version={number};\nCOMMIT;"
+            )
 
 
 class User:
-    def __init__(
-        self,
-        database: "Database",
-        user_id: str,
-        display_name: str,
-        access_token: str,
-        refresh_token: str,
-        expires_at: int,
-        listening_to: Union[str, None],
-        playing_to: Union[str, None],
-        paused: int,
-        device_id: Union[str, None],
-    ):
+    """A user, backed by a row with the columns in ``USER_COLUMNS``
+
+    The access token is only wrapped in a ``SpotifyAuth`` when an API call
+    asks for it.
+
+    """
+
+    __slots__ = (
+        "database",
+        "user_id",
+        "display_name",
+        "listening_to_id",
+        "playing_to_id",
+        "paused",
+        "device_id",
+        "_row",
+        "_auth",
+    )
+
+    def __init__(self, database: "Database", row: Sequence):
         self.database = database
-        self.user_id = user_id
-        self.display_name = display_name
-        self.auth = SpotifyAuth(access_token, refresh_token, expires_at)
-        self.listening_to_id = listening_to
-        self.playing_to_id = playing_to
-        self.paused = bool(paused)
-        self.device_id = device_id
+        self._row = row
+        self._auth: Optional[SpotifyAuth] = None
+        self.user_id: str = row[0]
+        self.display_name: str = row[1]
+        self.listening_to_id: Union[str, None] = row[5]
+        self.playing_to_id: Union[str, None] = row[6]
+        self.paused = bool(row[7])
+        self.device_id: Union[str, None] = row[8]
 
     @classmethod
     def from_row(
-        cls, database: "Database", row: Union[Iterable, None]
+        cls, database: "Database", row: Union[Sequence, None]
     ) -> Union["User", None]:
         if row is None:
             return None
-        return cls(database, *row)
+        return cls(database, row)
+
+    @property
+    def auth(self) -> SpotifyAuth:
+        if self._auth is None:
+            self._auth = SpotifyAuth(*self._row[2:5])
+        return self._auth
+
+    @auth.setter
+    def auth(self, auth: SpotifyAuth) -> None:
+        self._auth = auth
 
     @property
     async def listening_to(self) -> Union["Room", None]:
@@ -74,22 +155,36 @@ class User:
         return await self.database.get_room(self.playing_to_id)
 
     async def update_auth(self, request: web.Request) -> None:
-        changed, auth = await api.update_auth(request, self.auth)
-        if changed:
-            await self.database.update_auth(self, auth)
-            self.auth = auth
+        await api.update_auth(request, self)
 
     async def set_device_id(self, device_id: str) -> None:
+        if device_id == self.device_id:
+            return
         await self.database.set_device_id(self.user_id, device_id)
         self.device_id = device_id
 
     async def transfer(
         self, request: web.Request, *, play: bool = False, check: bool = True
     ) -> bool:
+        """Move the user's playback to their device
+
+        If ``check`` is true, wait for the device to become active. Transfers
+        to a device that was recently seen active are skipped, unless
+        ``play`` asks for the playback to start too.
+
+        """
         if self.device_id is None:
             return False
 
-        # No active device: transfer first
+        devices = api.get_app(request)["devices"]
+        if (
+            check
+            and not play
+            and devices.is_active(self.user_id, self.device_id)
+        ):
+            devices.skipped += 1
+            return True
+
         try:
             await api.call_api(
                 request,
@@ -99,19 +194,11 @@ class User:
                 json=dict(device_ids=[self.device_id], play=play),
             )
         except ClientResponseError as e:
-            print(f"'/me/player' returned {e.status}")
+            logger.warning(f"'/me/player' returned {e.status}")
             return False
 
         if check:
-            await asyncio.sleep(1)
-            response = await api.call_api(request, self, "/me/player/devices")
-            if response is None:
-                return False
-            return any(
-                device.get("is_active", False)
-                and (device.get("id", None) == self.device_id)
-                for device in response.json().get("devices", [])
-            )
+            return await devices.wait(request, self) is not None
 
         return True
 
@@ -130,13 +217,14 @@ class User:
 
     async def stop(self, request: web.Request) -> bool:
         """Like pause, but update the database too"""
-        room = await self.playing_to
-        if room is None:
-            flag = await self.pause(request)
-        else:
-            flag = await room.stop(request)
+        async with self.database.transaction():
+            room = await self.playing_to
+            if room is None:
+                flag = await self.pause(request)
+            else:
+                flag = await room.stop(request)
 
-        await request.app["db"].stop(self.user_id)
+            await self.database.stop(self.user_id)
 
         return flag
 
@@ -147,6 +235,7 @@ class User:
         *,
         retries: int = DEFAULT_RETRIES,
     ) -> bool:
+        start = time.monotonic()
         try:
             await api.call_api(
                 request, self, "/me/player/play", method="PUT", json=data
@@ -156,9 +245,12 @@ class User:
             if e.status not in (403, 404):
                 raise
 
-            flag = await self.transfer(request, play=True, check=False)
+            # There is no active device, so the one we knew about is gone
+            api.get_app(request)["devices"].forget(self.user_id)
+            flag = await self.transfer(request, play=True)
             if flag and retries > 0:
-                await asyncio.sleep(1)
+                # The host kept playing while the device was transferred
+                data = sync.advance(data, time.monotonic() - start)
                 return await self.play(request, data, retries=retries - 1)
 
             return False
@@ -166,7 +258,7 @@ class User:
         return True
 
     async def currently_playing(
-        self, request: web.Request
+        self, request: Union[web.Request, web.Application]
     ) -> Union[Dict[str, Any], None]:
         response = await api.call_api(
             request, self, "/me/player/currently-playing"
@@ -175,39 +267,70 @@ class User:
             return None
         data = response.json()
         item = data.get("item", {})
-        return {
+        state = {
             "uri": item.get("uri", None),
             "name": item.get("name", None),
             "type": item.get("type", None),
             "id": item.get("id", None),
             "position_ms": data.get("progress_ms", None),
+            "duration_ms": item.get("duration_ms", None),
             "is_playing": data.get("is_playing", False),
         }
 
+        # The position was read about one way trip before the response came
+        # back, or even earlier if the response was shared
+        latency = api.get_app(request)["latency"].one_way(self.user_id)
+        return sync.project(state, latency + api.get_age(response))
+
     async def sync(
         self, request: web.Request, *, retries: int = DEFAULT_RETRIES
     ) -> Union[Mapping[str, Any], None]:
+        """Match the listener's playback to the host's
+
+        Both players are read at the same time and the seek is skipped if the
+        listener is already within ``sync_tolerance`` of the host. Otherwise,
+        the target position is moved forward by the listener's one way
+        latency so that it is right when the command reaches the player. The
+        result includes the measured ``drift_ms`` (or ``None`` if the
+        listener wasn't playing the same track).
+
+        """
         room = await self.listening_to
         if room is None:
             return None
 
-        data = await room.host.currently_playing(request)
+        (data, host_at), (current, current_at) = await asyncio.gather(
+            sync.stamp(room.currently_playing(request)),
+            sync.stamp(self.currently_playing(request)),
+        )
         if data is None:
             return None
 
+        now = time.monotonic()
+        data = sync.project(data, now - host_at)
+        current = sync.project(current, now - current_at)
+        drift_ms = sync.get_drift(data, current)
+        if drift_ms is not None:
+            metrics.sync_drift.observe(1e-3 * abs(drift_ms))
+
         if (
             data.pop("is_playing")
             and data["uri"] is not None
             and data["position_ms"] is not None
         ):
-            await self.play(
-                request,
-                dict(uris=[data["uri"]], position_ms=data["position_ms"]),
-                retries=retries,
-            )
-        else:
+            tolerance = 1000 * request.app["config"]["sync_tolerance"]
+            if drift_ms is None or abs(drift_ms) > tolerance:
+                latency = request.app["latency"].one_way(self.user_id)
+                target = dict(
+                    uris=[data["uri"]], position_ms=data["position_ms"]
+                )
+                await self.play(
+                    request, sync.advance(target, latency), retries=retries
+                )
+        elif drift_ms is None:
             await self.pause(request, retries=retries)
 
+        data["drift_ms"] = drift_ms
         return data
 
     async def listen_to(
@@ -218,11 +341,15 @@ class User:
         *,
         retries: int = DEFAULT_RETRIES,
     ) -> Union[Mapping[str, Any], None]:
-        await self.set_device_id(device_id)
+        async with self.database.transaction():
+            await self.set_device_id(device_id)
 
-        await self.stop(request)
+            await self.stop(request)
+
+            await self.database.listen_to(
+                self.user_id, room.room_id, display_name=self.display_name
+            )
 
-        await self.database.listen_to(self.user_id, room.room_id)
         self.listening_to_id = room.room_id
         self.paused = False
 
@@ -231,17 +358,21 @@ class User:
     async def play_to(
         self, request: web.Request, device_id: str, *, room_name: str
     ) -> Optional[str]:
-        await self.set_device_id(device_id)
+        async with self.database.transaction():
+            await self.set_device_id(device_id)
 
-        await self.stop(request)
+            await self.stop(request)
 
-        await self.transfer(request)
-        flag = await self.play(request, {})
-        if not flag:
-            return None
+            await self.transfer(request)
+            flag = await self.play(request, {})
+            if not flag:
+                return None
+
+            room_id = f"{self.user_id}/{room_name}"
+            await self.database.add_room(self, room_id)
 
-        room_id = f"{self.user_id}/{room_name}"
-        await self.database.add_room(self, room_id)
+        # The poller needs to find the committed room
+        request.app["pollers"].start(room_id, self.user_id)
 
         self.listening_to_id = None
         self.playing_to_id = room_id
@@ -251,65 +382,370 @@ class User:
 
 
 class Room:
+    __slots__ = ("host", "room_id")
+
     def __init__(self, host: User):
         self.host = host
         self.room_id = host.playing_to_id
-        self.host_id = host.user_id
+
+    @property
+    def host_id(self) -> str:
+        return self.host.user_id
 
     @classmethod
     def from_row(
-        cls, database: "Database", row: Union[Iterable, None]
+        cls, database: "Database", row: Union[Sequence, None]
     ) -> Union["Room", None]:
         if row is None:
             return None
-        return cls(User(database, *row))
+        return cls(User(database, row))
 
     @property
-    async def listeners(self) -> List[Union[User, None]]:
-        return await self.host.database.get_listeners(self.room_id)
+    async def listener_count(self) -> int:
+        return await self.host.database.count_listeners(self.room_id)
+
+    def iter_active_listeners(self) -> AsyncIterator[User]:
+        return self.host.database.iter_listeners(self.room_id, active=True)
+
+    async def currently_playing(
+        self, request: web.Request
+    ) -> Union[Dict[str, Any], None]:
+        """The host's playback, from the room's poller if it is running"""
+        poller = request.app["pollers"].get(self.room_id)
+        if poller is not None and poller.fresh:
+            return poller.current()
+        return await self.host.currently_playing(request)
 
     async def play(
         self, request: web.Request, uri: str, position_ms: Optional[int] = None
-    ) -> bool:
+    ) -> fanout.FanoutResult:
         data: MutableMapping[str, Any] = dict(uris=[uri])
         if position_ms is not None:
             data["position_ms"] = position_ms
+        return await fanout.fan_out(
+            self.iter_active_listeners(),
+            lambda user: user.play(request, data),
+            limit=request.app["config"]["fanout_concurrency"],
+        )
 
-        success = True
-        for user in await self.listeners:
-            if user is None or user.paused:
-                continue
-            flag = await user.play(request, data)
-            if not flag:
-                success = False
-        return success
-
-    async def pause(self, request: web.Request) -> bool:
-        success = True
-        for user in await self.listeners:
-            if user is None or user.paused:
-                continue
-            flag = await user.pause(request)
-            if not flag:
-                success = False
-        return success
+    async def pause(self, request: web.Request) -> fanout.FanoutResult:
+        return await fanout.fan_out(
+            self.iter_active_listeners(),
+            lambda user: user.pause(request),
+            limit=request.app["config"]["fanout_concurrency"],
+        )
 
     async def stop(self, request: web.Request) -> bool:
         if self.room_id is None:
             return False
+        await request.app["pollers"].stop(self.room_id)
         success = await self.host.pause(request)
-        success = success and await self.pause(request)
+        success = success and bool(await self.pause(request))
         await self.host.database.close_room(self.room_id)
         return success
 
 
+class WriteBatch:
+    """The statements of one logical operation, committed atomically"""
+
+    def __init__(self) -> None:
+        self.statements: List[Tuple[str, Sequence]] = []
+        self.tags: Set[Tuple[str, Union[str, None]]] = set()
+        self.events: List[Tuple[str, Tuple]] = []
+        self.task = asyncio.current_task()
+        self.future: Optional[asyncio.Future] = None
+
+    def execute(self, sql: str, params: Sequence = ()) -> None:
+        self.statements.append((sql, params))
+
+    def notify(self, event: str, *args: Any) -> None:
+        """Announce a mutation to the observers once it's committed"""
+        self.events.append((event, args))
+
+
+# The unit of work opened by Database.transaction in the current task
+current_batch: "ContextVar[Optional[WriteBatch]]" = ContextVar(
+    "current_batch", default=None
+)
+
+
 class Database:
-    def __init__(self, filename: Union[str, pathlib.Path]):
+    """The interface to the SQLite database
+
+    This owns a pool of long-lived connections (one writer and ``pool_size``
+    readers) that is opened and closed in the app's ``cleanup_ctx``. Each
+    connection keeps its own cache of prepared statements between calls.
+
+    Writes are queued as batches and the batches that arrive within
+    ``commit_delay`` of each other are written in a single transaction (a
+    group commit), each in its own savepoint so that a failing batch doesn't
+    take the others down with it.
+
+    Args:
+        filename: The path to the database file
+        pool_size (int, optional): The number of reader connections
+        busy_timeout (float, optional): The number of seconds to wait for a
+            lock on the database before failing
+        cache_size (int, optional): The maximum number of cached lookups
+        cache_ttl (float, optional): The lifetime of a cached lookup in
+            seconds
+        commit_delay (float, optional): How long to wait for more writes
+            before committing, in seconds
+
+    """
+
+    def __init__(
+        self,
+        filename: Union[str, pathlib.Path],
+        *,
+        pool_size: int = 4,
+        busy_timeout: float = 5.0,
+        cache_size: int = 1024,
+        cache_ttl: float = 5.0,
+        commit_delay: float = 0.002,
+    ):
         self.filename = filename
+        self.cache = cache.LRUCache(maxsize=cache_size, ttl=cache_ttl)
+        self.pool_size = max(1, int(pool_size))
+        self.busy_timeout = busy_timeout
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._write_lock: Optional[asyncio.Lock] = None
+        self._readers: "Optional[asyncio.Queue[aiosqlite.Connection]]" = None
+
+        self.commit_delay = commit_delay
+        self.commits = 0
+        self.batches = 0
+        self._pending: List[WriteBatch] = []
+        self._flush_task: Optional[asyncio.Future] = None
+
+        # Called with the tags of every committed write, so that other
+        # processes can drop their cached copies too
+        self.on_invalidate: List[Callable[[Tuple], None]] = []
+
+        # Called with each (event, args) announced by a committed write,
+        # like ("add_room", (host_id, room_id))
+        self.on_mutation: List[Callable[[str, Tuple], None]] = []
+
+    async def _open(
+        self, isolation_level: Optional[str] = ""
+    ) -> aiosqlite.Connection:
+        conn = await aiosqlite.connect(
+            self.filename,
+            timeout=self.busy_timeout,
+            isolation_level=isolation_level,
+            cached_statements=STATEMENT_CACHE_SIZE,
+        )
+        await conn.execute("PRAGMA journal_mode=WAL")
+        await conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
 
+    async def connect(self) -> None:
+        if self._writer is not None:
+            return
+        self._write_lock = asyncio.Lock()
+        self._readers = asyncio.Queue()
+
+        # The group commit begins its transactions explicitly
+        self._writer = await self._open(None)
+
+        async with self._writer.execute("PRAGMA user_version") as cursor:
+            (version,) = await cursor.fetchone()
+        if version < SCHEMA_VERSION:
+            await self._writer.close()
+            self._writer = None
+            raise RuntimeError(
+                f"the database schema is out of date ({version} < "
+                f"{SCHEMA_VERSION}); run with '--create-tables' to upgrade"
+            )
+
+        for _ in range(self.pool_size):
+            self._readers.put_nowait(await self._open())
+
+    async def close(self) -> None:
+        if self._writer is None:
+            return
+        if self._flush_task is not None:
+            await self._flush_task
+        async with self._write_lock:
+            await self._writer.close()
+            self._writer = None
+        for _ in range(self.pool_size):
+            conn = await self._readers.get()
+            await conn.close()
+        self._readers = None
+
+    @asynccontextmanager
+    async def _read(self) -> AsyncIterator[aiosqlite.Connection]:
+        """Borrow a reader connection from the pool"""
+        if self._readers is None:
+            raise RuntimeError("the database is not connected")
+        conn = await self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put_nowait(conn)
+
+    @asynccontextmanager
+    async def transaction(self) -> AsyncIterator[None]:
+        """Write everything in this block in a single transaction
+
+        The writes are deferred until the block exits, so reads inside the
+        block don't see them. Nested blocks join the outer one and nothing is
+        written if the block raises.
+
+        """
+        batch = current_batch.get()
+        if batch is not None and batch.task is asyncio.current_task():
+            yield
+            return
+
+        batch = WriteBatch()
+        token = current_batch.set(batch)
+        try:
+            yield
+        finally:
+            current_batch.reset(token)
+        await self._commit(batch)
+
+    @asynccontextmanager
+    async def _write(
+        self, *tags: Tuple[str, Union[str, None]]
+    ) -> AsyncIterator[WriteBatch]:
+        """Queue statements and wait for them to be committed
+
+        Inside :meth:`transaction`, the statements join the current unit of
+        work instead. Cached lookups labeled with any of ``tags`` are
+        invalidated after the commit.
+
+        """
+        batch = current_batch.get()
+        if batch is not None and batch.task is asyncio.current_task():
+            batch.tags.update(tags)
+            yield batch
+            return
+
+        batch = WriteBatch()
+        batch.tags.update(tags)
+        yield batch
+        await self._commit(batch)
+
+    async def _commit(self, batch: WriteBatch) -> None:
+        if not batch.statements:
+            return
+        if self._writer is None:
+            raise RuntimeError("the database is not connected")
+        batch.future = asyncio.get_event_loop().create_future()
+        self._pending.append(batch)
+        if self._flush_task is None:
+            self._flush_task = asyncio.ensure_future(self._flush())
+
+        # The write goes ahead even if the caller is cancelled
+        await asyncio.shield(batch.future)
+
+    async def _flush(self) -> None:
+        await asyncio.sleep(self.commit_delay)
+        async with self._write_lock:
+            batches, self._pending = self._pending, []
+            self._flush_task = None
+
+            conn = self._writer
+            errors: List[Optional[Exception]] = []
+            try:
+                # Take the write lock up front so that writers in other
+                # processes wait on the busy timeout instead of deadlocking
+                await conn.execute("BEGIN IMMEDIATE")
+                for batch in batches:
+                    await conn.execute("SAVEPOINT batch")
+                    try:
+                        for sql, params in batch.statements:
+                            await conn.execute(sql, params)
+                    except Exception as e:
+                        await conn.execute("ROLLBACK TO batch")
+                        errors.append(e)
+                    else:
+                        errors.append(None)
+                    await conn.execute("RELEASE batch")
+                await conn.execute("COMMIT")
+            except Exception as e:
+                await conn.rollback()
+                for batch in batches:
+                    batch.future.set_exception(e)
+                return
+
+        self.commits += 1
+        self.batches += len(batches)
+        for batch, error in zip(batches, errors):
+            if error is not None:
+                batch.future.set_exception(error)
+                continue
+            tags = tuple(batch.tags)
+            self.cache.invalidate_tags(*tags)
+            for callback in self.on_invalidate:
+                callback(tags)
+            for event, args in batch.events:
+                self.notify(event, args)
+            batch.future.set_result(None)
+
+    def notify(
+        self,
+        event: str,
+        args: Tuple,
+        *,
+        exclude: Optional[Callable[[str, Tuple], None]] = None,
+    ) -> None:
+        for callback in self.on_mutation:
+            if callback is exclude:
+                continue
+            try:
+                callback(event, args)
+            except Exception:
+                logger.exception(f"failed to handle the '{event}' event")
+
+    async def _fetch(
+        self,
+        key: Tuple[Any, ...],
+        query: str,
+        params: Iterable,
+        *,
+        tag: Tuple[str, str],
+    ) -> Any:
+        """Run a single-row read query through the cache
+
+        The entry is tagged with ``tag`` and with the user and room IDs of
+        the row so that the mutations can invalidate it. The row must have
+        the columns in ``USER_COLUMNS``.
+
+        """
+        value = self.cache.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+
+        version = self.cache.version
+        async with self._read() as conn:
+            async with conn.execute(query, params) as cursor:
+                value = await cursor.fetchone()
+
+        user_index = USER_COLUMNS.index("user_id")
+        room_indices = [
+            n
+            for n, name in enumerate(USER_COLUMNS)
+            if name in ("listening_to", "playing_to")
+        ]
+        tags = {tag}
+        if value is not None:
+            tags.add(("user", value[user_index]))
+            tags.update(
+                ("room", value[n])
+                for n in room_indices
+                if value[n] is not None
+            )
+        self.cache.set(key, value, tags=tags, version=version)
+        return value
+
+    @timed("update_auth")
     async def update_auth(self, user: User, auth: SpotifyAuth) -> None:
-        async with aiosqlite.connect(self.filename) as conn:
-            await conn.execute(
+        async with self._write(("user", user.user_id)) as batch:
+            batch.execute(
                 """UPDATE users SET
                     access_token=?,
                     refresh_token=?,
@@ -322,13 +758,13 @@ class Database:
                     user.user_id,
                 ),
             )
-            await conn.commit()
 
+    @timed("add_user")
     async def add_user(
         self, user_id: str, display_name: str, auth: SpotifyAuth
     ) -> Union[User, None]:
-        async with aiosqlite.connect(self.filename) as conn:
-            await conn.execute(
+        async with self._write(("user", user_id)) as batch:
+            batch.execute(
                 """
                 INSERT INTO users(
                     user_id,display_name,access_token,refresh_token,expires_at)
@@ -347,133 +783,201 @@ class Database:
                     auth.expires_at,
                 ),
             )
-            await conn.commit()
         return await self.get_user(user_id)
 
+    @timed("set_device_id")
     async def set_device_id(
         self, user_id: Union[str, None], device_id: str
     ) -> None:
         if user_id is None:
             return
-        async with aiosqlite.connect(self.filename) as conn:
-            await conn.execute(
+        async with self._write(("user", user_id)) as batch:
+            batch.execute(
                 "UPDATE users SET device_id=? WHERE user_id=?",
                 (device_id, user_id),
             )
-            await conn.commit()
 
+    @timed("get_user")
     async def get_user(self, user_id: Union[str, None]) -> Union[User, None]:
         if user_id is None:
             return None
-        async with aiosqlite.connect(self.filename) as conn:
-            async with conn.execute(
-                "SELECT * FROM users WHERE user_id=?", (user_id,)
-            ) as cursor:
-                return User.from_row(self, await cursor.fetchone())
+        row = await self._fetch(
+            ("user", user_id),
+            f"{SELECT_USERS} WHERE user_id=?",
+            (user_id,),
+            tag=("user", user_id),
+        )
+        return User.from_row(self, row)
 
+    @timed("pause_user")
     async def pause_user(self, user_id: Union[str, None]) -> None:
         if user_id is None:
             return
-        async with aiosqlite.connect(self.filename) as conn:
-            await conn.execute(
+        async with self._write(("user", user_id)) as batch:
+            batch.execute(
                 "UPDATE users SET paused=1 WHERE user_id=?", (user_id,)
             )
-            await conn.commit()
 
+    @timed("unpause_user")
     async def unpause_user(self, user_id: Union[str, None]) -> None:
         if user_id is None:
             return
-        async with aiosqlite.connect(self.filename) as conn:
-            await conn.execute(
+        async with self._write(("user", user_id)) as batch:
+            batch.execute(
                 "UPDATE users SET paused=0 WHERE user_id=?", (user_id,)
             )
-            await conn.commit()
 
+    @timed("listen_to")
     async def listen_to(
-        self, user_id: Union[str, None], room_id: Union[str, None]
+        self,
+        user_id: Union[str, None],
+        room_id: Union[str, None],
+        *,
+        display_name: Optional[str] = None,
     ) -> None:
         if user_id is None or room_id is None:
             return
-        async with aiosqlite.connect(self.filename) as conn:
-            await conn.execute(
+        async with self._write(("user", user_id), ("room", room_id)) as batch:
+            batch.execute(
                 "UPDATE users SET listening_to=?, paused=0 WHERE user_id=?",
                 (room_id, user_id),
             )
-            await conn.commit()
+            batch.notify("listen_to", user_id, room_id, display_name)
 
+    @timed("stop")
     async def stop(self, user_id: Union[str, None]) -> None:
         if user_id is None:
             return
-        async with aiosqlite.connect(self.filename) as conn:
-            await conn.execute(
+        async with self._write(("user", user_id)) as batch:
+            batch.execute(
                 """UPDATE users SET
                   listening_to=NULL, playing_to=NULL
                 WHERE user_id=?""",
                 (user_id,),
             )
-            await conn.commit()
+            batch.notify("stop", user_id)
 
+    @timed("get_room")
     async def get_room(self, room_id: Union[str, None]) -> Union[Room, None]:
         if room_id is None:
             return None
-        async with aiosqlite.connect(self.filename) as conn:
-            async with conn.execute(
-                "SELECT * FROM users WHERE playing_to=?", (room_id,)
-            ) as cursor:
-                return Room.from_row(self, await cursor.fetchone())
+        row = await self._fetch(
+            ("room", room_id),
+            f"{SELECT_USERS} WHERE playing_to=?",
+            (room_id,),
+            tag=("room", room_id),
+        )
+        return Room.from_row(self, row)
 
+    @timed("add_room")
     async def add_room(self, host: User, room_id: str) -> str:
-        async with aiosqlite.connect(self.filename) as conn:
-            await conn.execute(
+        async with self._write(
+            ("user", host.user_id), ("room", room_id)
+        ) as batch:
+            batch.execute(
                 "UPDATE users SET playing_to=?, paused=0 WHERE user_id=?",
                 (room_id, host.user_id),
             )
-            await conn.commit()
+            batch.notify("add_room", host.user_id, room_id, host.display_name)
         return room_id
 
+    @timed("get_room_ids")
+    async def get_room_ids(self) -> List[str]:
+        """The IDs of all of the open rooms (this isn't cached)"""
+        async with self._read() as conn:
+            async with conn.execute("SELECT room_id FROM rooms") as cursor:
+                return [room_id for (room_id,) in await cursor.fetchall()]
+
+    @timed("pause_room")
     async def pause_room(self, room_id: str) -> None:
-        async with aiosqlite.connect(self.filename) as conn:
-            await conn.execute(
+        async with self._write(("room", room_id)) as batch:
+            batch.execute(
                 "UPDATE users SET paused=1 WHERE playing_to=?", (room_id,)
             )
-            await conn.commit()
 
+    @timed("close_room")
     async def close_room(self, room_id: str) -> None:
-        async with aiosqlite.connect(self.filename) as conn:
-            await conn.execute(
+        async with self._write(("room", room_id)) as batch:
+            batch.execute(
                 "UPDATE users SET playing_to=NULL WHERE playing_to=?",
                 (room_id,),
             )
-            await conn.execute(
+            batch.execute(
                 "UPDATE users SET listening_to=NULL WHERE listening_to=?",
                 (room_id,),
             )
-            await conn.commit()
+            batch.notify("close_room", room_id)
+
+    async def iter_listeners(
+        self,
+        room_id: Union[str, None],
+        *,
+        active: bool = False,
+        page_size: int = LISTENER_PAGE_SIZE,
+    ) -> AsyncIterator[User]:
+        """Stream the users listening to a room, optionally only the unpaused
 
-    async def get_listeners(
-        self, room_id: Union[str, None]
-    ) -> List[Union[User, None]]:
+        The listeners are read in pages of ``page_size`` ordered by user ID,
+        and no connection is held while the caller handles them. These reads
+        bypass the cache.
+
+        """
+        if room_id is None:
+            return
+        query = f"{SELECT_USERS} WHERE listening_to=? AND user_id>?"
+        if active:
+            query += " AND paused=0"
+        query += " ORDER BY user_id LIMIT ?"
+
+        last = ""
+        while True:
+            async with self._read() as conn:
+                async with conn.execute(
+                    query, (room_id, last, page_size)
+                ) as cursor:
+                    rows = await cursor.fetchall()
+            for row in rows:
+                yield User(self, row)
+            if len(rows) < page_size:
+                return
+            last = rows[-1][0]
+
+    @timed("count_listeners")
+    async def count_listeners(self, room_id: Union[str, None]) -> int:
+        """The number of listeners in a room, from the rooms table"""
         if room_id is None:
-            return []
-        async with aiosqlite.connect(self.filename) as conn:
+            return 0
+        async with self._read() as conn:
             async with conn.execute(
-                "SELECT * FROM users WHERE listening_to=?", (room_id,)
+                "SELECT listener_count FROM rooms WHERE room_id=?", (room_id,)
+            ) as cursor:
+                row = await cursor.fetchone()
+        return 0 if row is None else row[0]
+
+    @timed("get_expiring_users")
+    async def get_expiring_users(self, before: float) -> List[User]:
+        """Get the users in active rooms whose tokens expire before a time"""
+        async with self._read() as conn:
+            async with conn.execute(
+                f"""
+                {SELECT_USERS}
+                WHERE expires_at < ? AND (
+                    listening_to IS NOT NULL OR playing_to IS NOT NULL
+                )
+                """,
+                (before,),
             ) as cursor:
                 return [User.from_row(self, row) async for row in cursor]
 
-    async def get_room_stats(self) -> Iterable:
-        async with aiosqlite.connect(self.filename) as conn:
+    @timed("get_room_members")
+    async def get_room_members(self) -> List[Tuple[str, str, Any, Any]]:
+        """The hosts and listeners of every room (this isn't cached)"""
+        async with self._read() as conn:
             async with conn.execute(
                 """
-                SELECT
-                    main.user_id,
-                    main.display_name,
-                    main.playing_to,
-                    count(other.user_id)
-                FROM users AS main
-                LEFT JOIN users AS other ON
-                    main.playing_to = other.listening_to
-                WHERE main.playing_to IS NOT NULL
+                SELECT user_id, display_name, listening_to, playing_to
+                FROM users
+                WHERE listening_to IS NOT NULL OR playing_to IS NOT NULL
                 """
             ) as cursor:
-                return await cursor.fetchall()
+                return list(await cursor.fetchall())
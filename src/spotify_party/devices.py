@@ -0,0 +1,112 @@
+__all__ = ["DeviceTracker"]
+
+import asyncio
+import logging
+import time
+from typing import TYPE_CHECKING, Optional, Union
+
+from aiohttp import web
+
+from . import api, cache, metrics
+
+if TYPE_CHECKING:
+    from .db import User
+
+logger = logging.getLogger(__name__)
+
+
+class DeviceTracker:
+    """Wait for the users' Spotify devices to become active
+
+    After a transfer, the devices endpoint is polled after ``min_interval``
+    seconds, backing off by ``factor`` up to ``max_interval``, until the
+    device is listed as active or ``timeout`` seconds have passed. The device
+    that each user was last seen on is remembered for ``ttl`` seconds so that
+    transfers to a device that is already active can be skipped.
+
+    Args:
+        timeout (float, optional): How long to wait for a device, in seconds
+        ttl (float, optional): How long an active device is remembered, in
+            seconds
+        min_interval (float, optional): The delay before the first poll
+        max_interval (float, optional): The longest delay between polls
+        factor (float, optional): The growth of the delay between polls
+
+    """
+
+    def __init__(
+        self,
+        *,
+        timeout: float = 5.0,
+        ttl: float = 30.0,
+        min_interval: float = 0.1,
+        max_interval: float = 1.0,
+        factor: float = 1.5,
+        max_users: int = 4096,
+    ):
+        self.timeout = timeout
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.factor = factor
+        self.active = cache.LRUCache(maxsize=max_users, ttl=ttl)
+        self.skipped = 0
+
+    def is_active(self, user_id: str, device_id: Union[str, None]) -> bool:
+        return device_id is not None and self.active.get(user_id) == device_id
+
+    def remember(self, user_id: str, device_id: str) -> None:
+        self.active.set(user_id, device_id)
+
+    def forget(self, user_id: str) -> None:
+        self.active.invalidate(user_id)
+
+    async def get_active_device(
+        self, request: Union[web.Request, web.Application], user: "User"
+    ) -> Optional[str]:
+        # Only a response from after the transfer can say that it's done
+        response = await api.call_api(
+            request, user, "/me/player/devices", max_age=0.0
+        )
+        if response is None:
+            return None
+        for device in response.json().get("devices", []):
+            if device.get("is_active", False):
+                return device.get("id", None)
+        return None
+
+    async def wait(
+        self, request: Union[web.Request, web.Application], user: "User"
+    ) -> Optional[float]:
+        """Wait for the user's device to become active
+
+        Returns:
+            Optional[float]: The number of seconds that the device took to
+            become active, or ``None`` if it didn't before the deadline
+
+        """
+        start = time.monotonic()
+        deadline = start + self.timeout
+        interval = self.min_interval
+        while True:
+            await asyncio.sleep(
+                max(0.0, min(interval, deadline - time.monotonic()))
+            )
+            device_id = await self.get_active_device(request, user)
+            elapsed = time.monotonic() - start
+            if device_id is not None and device_id == user.device_id:
+                self.remember(user.user_id, device_id)
+                metrics.device_ready.observe(elapsed, outcome="ready")
+                logger.debug(
+                    f"device for '{user.user_id}' ready after {elapsed:.2f}s"
+                )
+                return elapsed
+
+            if start + elapsed >= deadline:
+                metrics.device_ready.observe(elapsed, outcome="timeout")
+                logger.warning(
+                    f"device for '{user.user_id}' not ready after "
+                    f"{elapsed:.2f}s"
+                )
+                return None
+
+            interval = min(interval * self.factor, self.max_interval)
@@ -0,0 +1,114 @@
+__all__ = ["FanoutResult", "fan_out"]
+
+import asyncio
+import time
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    AsyncIterable,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Union,
+)
+
+if TYPE_CHECKING:
+    from .db import User
+
+
+class FanoutResult:
+    """The outcome of a call that was sent to a whole room
+
+    Only the failures are kept per listener so that the result stays small
+    for large rooms.
+
+    """
+
+    def __init__(self) -> None:
+        self.number = 0
+        self.slowest_ms = 0.0
+        self.errors: Dict[str, Optional[str]] = {}
+
+    def add(
+        self,
+        user_id: str,
+        success: bool,
+        elapsed_ms: float,
+        error: Optional[str] = None,
+    ) -> None:
+        self.number += 1
+        self.slowest_ms = max(self.slowest_ms, elapsed_ms)
+        if not success:
+            self.errors[user_id] = error
+
+    @property
+    def success(self) -> bool:
+        return not self.errors
+
+    @property
+    def failed(self) -> List[str]:
+        return list(self.errors)
+
+    def __bool__(self) -> bool:
+        return self.success
+
+    def __len__(self) -> int:
+        return self.number
+
+    def to_json(self) -> Dict[str, Any]:
+        return dict(
+            number=len(self), failed=self.failed, slowest_ms=self.slowest_ms
+        )
+
+
+async def iterate(users: Iterable["User"]) -> AsyncIterator["User"]:
+    for user in users:
+        yield user
+
+
+async def fan_out(
+    users: Union[Iterable["User"], AsyncIterable["User"]],
+    func: Callable[["User"], Awaitable[bool]],
+    *,
+    limit: int,
+) -> FanoutResult:
+    """Call ``func`` for every user with at most ``limit`` calls in flight
+
+    The users can be streamed from an async iterator; they're only pulled as
+    the workers become free. A failure (or exception) for one user is
+    recorded in the result instead of interrupting the calls for the rest of
+    the room.
+
+    """
+    result = FanoutResult()
+    if isinstance(users, AsyncIterable):
+        iterator = users.__aiter__()
+    else:
+        iterator = iterate(users)
+    lock = asyncio.Lock()
+
+    async def worker() -> None:
+        while True:
+            # Async generators can't be advanced by two tasks at once
+            async with lock:
+                try:
+                    user = await iterator.__anext__()
+                except StopAsyncIteration:
+                    return
+            start = time.monotonic()
+            error = None
+            try:
+                flag = bool(await func(user))
+            except Exception as e:
+                flag = False
+                error = f"{type(e).__name__}: {e}"
+            result.add(
+                user.user_id, flag, 1000 * (time.monotonic() - start), error
+            )
+
+    await asyncio.gather(*(worker() for _ in range(max(1, limit))))
+    return result
@@ -1,19 +1,125 @@
-__all__ = ["generate_room_name"]
+__all__ = ["RoomNameAllocator"]
 
 import random
+from functools import lru_cache
+from typing import Dict, Iterable, Optional, Sequence, Tuple
 
-import pkg_resources
+from . import cache, resources
 
-with open(
-    pkg_resources.resource_filename(__name__, "wordlists/descriptors.txt")
-) as f:
-    descriptors = ["-".join(word.strip().split()) for word in f]
 
-with open(
-    pkg_resources.resource_filename(__name__, "wordlists/genres.txt")
-) as f:
-    genres = ["-".join(word.strip().split()) for word in f]
+@lru_cache(maxsize=None)
+def get_wordlist(name: str) -> Sequence[str]:
+    """The words in a wordlist, loaded the first time they're needed"""
+    text = resources.read_text(f"wordlists/{name}.txt")
+    return ["-".join(word.split()) for word in text.splitlines()]
 
 
-def generate_room_name() -> str:
-    return random.choice(descriptors) + "-" + random.choice(genres)
+def get_room_name(room_id: str) -> str:
+    return room_id.split("/", 1)[-1]
+
+
+class RoomNameAllocator:
+    """Suggests names that no open room is using
+
+    Names are drawn at random from ``<descriptor>-<genre>`` and, once more
+    than ``max_load`` of those are taken, from ``<descriptor>-<genre>-<n>``
+    too, doubling the number of names each time. So a free name is found
+    after at most ``1 / (1 - max_load)`` draws on average, however many
+    rooms are open.
+
+    The names in use are loaded from the database at startup and then
+    follow the ``add_room`` and ``close_room`` mutations. Hosts can rename
+    their rooms, so a name may be used by several rooms at once. Suggested
+    names are also held for ``hold`` seconds, so that two hosts opening
+    their players at the same time don't get the same one; the
+    ``hold_room_name`` events share these with the other workers.
+
+    Args:
+        max_load (float, optional): The fraction of the names that can be
+            taken before the space of names grows
+        hold (float, optional): How long a suggested name is held, in seconds
+        max_held (int, optional): The maximum number of held names
+
+    """
+
+    max_draws = 64
+
+    def __init__(
+        self,
+        *,
+        max_load: float = 0.5,
+        hold: float = 600.0,
+        max_held: int = 4096,
+        rng: Optional[random.Random] = None,
+    ):
+        self.max_load = max_load
+        self.in_use: Dict[str, int] = {}
+        self.held = cache.LRUCache(maxsize=max_held, ttl=hold)
+        self.tiers = 1
+        self.random = random.Random() if rng is None else rng
+
+    @property
+    def base_size(self) -> int:
+        return len(get_wordlist("descriptors")) * len(get_wordlist("genres"))
+
+    @property
+    def size(self) -> int:
+        return self.tiers * self.base_size
+
+    def get_name(self, index: int) -> str:
+        descriptors = get_wordlist("descriptors")
+        genres = get_wordlist("genres")
+        tier, index = divmod(index, self.base_size)
+        descriptor, genre = divmod(index, len(genres))
+        name = f"{descriptors[descriptor]}-{genres[genre]}"
+        if tier:
+            name += f"-{tier + 1}"
+        return name
+
+    def allocate(self) -> str:
+        """A name that isn't in use, held until it's used or expires"""
+        # The fewest names that keep the load under max_load, which can
+        # shrink again as the rooms close and the holds expire
+        self.held.prune()
+        self.tiers = 1
+        while len(self.in_use) + len(self.held) > self.max_load * self.size:
+            self.tiers *= 2
+
+        draws = 0
+        while True:
+            name = self.get_name(self.random.randrange(self.size))
+            if name not in self.in_use and name not in self.held:
+                self.held.set(name, True)
+                return name
+            draws += 1
+            if draws >= self.max_draws:
+                # Very unlikely below max_load; make room instead of looping
+                self.tiers *= 2
+                draws = 0
+
+    def load(self, room_ids: Iterable[str]) -> None:
+        self.in_use.clear()
+        for room_id in room_ids:
+            self.open(room_id)
+
+    def open(self, room_id: str) -> None:
+        name = get_room_name(room_id)
+        self.in_use[name] = self.in_use.get(name, 0) + 1
+        self.held.invalidate(name)
+
+    def close(self, room_id: str) -> None:
+        name = get_room_name(room_id)
+        count = self.in_use.get(name, 0) - 1
+        if count > 0:
+            self.in_use[name] = count
+        else:
+            self.in_use.pop(name, None)
+
+    def observe(self, event: str, args: Tuple) -> None:
+        """Follow the rooms through the database's mutation events"""
+        if event == "add_room":
+            self.open(args[1])
+        elif event == "close_room":
+            self.close(args[0])
+        elif event == "hold_room_name":
+            self.held.set(args[0], True)
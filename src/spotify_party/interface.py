@@ -1,6 +1,8 @@
-__all__ = ["routes", "sio"]
+__all__ = ["routes", "sio", "connections", "ListenerBroadcaster", "move_user"]
 
-from typing import Any, Dict, Mapping
+import asyncio
+import logging
+from typing import Any, Dict, Mapping, Optional, Union
 
 import aiohttp_session
 import socketio
@@ -8,42 +10,139 @@ import yarl
 from aiohttp import web
 
 from . import api, db
+from .connections import ConnectionRegistry
+from .stats import STATS_ROOM
+
+logger = logging.getLogger(__name__)
 
 routes = web.RouteTableDef()
 sio = socketio.AsyncServer(async_mode="aiohttp", cors_allowed_origins="*")
+connections = ConnectionRegistry()
+
+
+def get_session_cookie(request: web.Request) -> Optional[str]:
+    storage = request.get(aiohttp_session.STORAGE_KEY)
+    if storage is None:
+        return None
+    return storage.load_cookie(request)
+
+
+def move_user(user_id: str, room_id: Union[str, None]) -> None:
+    """Move a user's sockets into a room (or out of all rooms)"""
+    for sid in connections.get_sids(user_id):
+        for current in connections.get_rooms(sid):
+            if current != room_id:
+                sio.leave_room(sid, current)
+                connections.leave(sid, current)
+        if room_id is not None:
+            sio.enter_room(sid, room_id)
+            connections.join(sid, room_id)
+
+
+class ListenerBroadcaster:
+    """Coalesce the ``listeners`` events sent to each room
+
+    The first membership change in a room schedules an event for ``delay``
+    seconds later; the changes that arrive in the meantime are folded into
+    it and the event carries the count at the time it is sent.
+
+    """
+
+    def __init__(self, app: web.Application, *, delay: float = 0.5):
+        self.app = app
+        self.delay = delay
+        self.sent = 0
+        self.saved = 0
+        self._pending: Dict[str, asyncio.Future] = {}
+
+    def schedule(self, room_id: str) -> None:
+        if room_id in self._pending:
+            self.saved += 1
+            return
+        self._pending[room_id] = asyncio.ensure_future(self._send(room_id))
+
+    async def _send(self, room_id: str) -> None:
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            # Changes from here on need an event of their own
+            del self._pending[room_id]
+        try:
+            number = await self.app["db"].count_listeners(room_id)
+            await sio.emit("listeners", {"number": number}, room=room_id)
+            self.sent += 1
+        except Exception:
+            logger.exception(f"failed to send the listeners of '{room_id}'")
+
+    async def close(self) -> None:
+        tasks = list(self._pending.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
 
 
 @sio.event
 async def connect(sid: str, environ: Mapping[str, Any]) -> bool:
-    # Check that this user is authenticated
     request = environ["aiohttp.request"]
-    session = await aiohttp_session.get_session(request)
-    user = await request.app["db"].get_user(session.get("sp_user_id"))
-    if user is None:
-        return False
+
+    # Reconnects with a known session cookie skip the session and database
+    cookie = get_session_cookie(request)
+    known = connections.lookup(cookie)
+    if known is None:
+        # Check that this user is authenticated
+        session = await aiohttp_session.get_session(request)
+        user = await request.app["db"].get_user(session.get("sp_user_id"))
+        if user is None:
+            return False
+        if user.listening_to_id is not None:
+            known = (user.user_id, user.listening_to_id)
+        else:
+            known = (user.user_id, user.playing_to_id)
+        connections.remember(cookie, *known)
+
+    user_id, room_id = known
+    connections.connect(sid, user_id)
 
     # Re-join the correct room if this is a re-connect
-    if user.listening_to_id is not None:
-        sio.enter_room(sid, user.listening_to_id)
-    elif user.playing_to_id is not None:
-        sio.enter_room(sid, user.playing_to_id)
+    if room_id is not None:
+        sio.enter_room(sid, room_id)
+        connections.join(sid, room_id)
 
     return True
 
 
 @sio.event
 async def disconnect(sid: str) -> None:
-    pass
+    connections.disconnect(sid)
 
 
 @sio.event
 async def join(sid: str, room_id: str) -> None:
+    if room_id == STATS_ROOM:
+        return
     sio.enter_room(sid, room_id)
+    connections.join(sid, room_id)
 
 
 @sio.event
 async def leave(sid: str, room_id: str) -> None:
     sio.leave_room(sid, room_id)
+    connections.leave(sid, room_id)
+
+
+@sio.event
+async def watch_stats(sid: str) -> None:
+    """Send the live room statistics to an admin's socket
+
+    The stats room isn't tracked in ``connections`` so that the socket stays
+    in it when its user moves between rooms.
+
+    """
+    app = sio.get_environ(sid)["aiohttp.request"].app
+    if connections.get_user_id(sid) not in app["config"]["admins"]:
+        return
+    sio.enter_room(sid, STATS_ROOM)
+    await sio.emit("stats", app["stats"].snapshot(), room=sid)
 
 
 #
@@ -90,18 +189,17 @@ async def stop(request: web.Request, user: db.User) -> web.Response:
     playing_to = await user.playing_to
     if playing_to is not None:
         await playing_to.pause(request)
+        await request.app["pollers"].stop(playing_to.room_id)
         await request.app["db"].close_room(playing_to.room_id)
         await sio.emit("close", room=playing_to.room_id)
+        move_user(user.user_id, None)
         return web.Response(body="stopped")
 
     listening_to = await user.listening_to
     if listening_to is not None:
         await user.stop(request)
-        await sio.emit(
-            "listeners",
-            {"number": len(await listening_to.listeners)},
-            room=listening_to.room_id,
-        )
+        move_user(user.user_id, None)
+        request.app["listener_broadcasts"].schedule(listening_to.room_id)
         return web.Response(body="stopped")
 
     return web.HTTPTemporaryRedirect(
@@ -131,6 +229,7 @@ async def broadcast_start(request: web.Request, user: db.User) -> web.Response:
     room_id = await user.play_to(request, device_id, room_name=room_name)
     if room_id is None:
         return web.json_response({"error": "Unable to transfer device"})
+    move_user(user.user_id, room_id)
 
     url = yarl.URL(request.app["config"]["base_url"]).with_path(
         f"/listen/{room_id}"
@@ -154,6 +253,7 @@ async def broadcast_stop(request: web.Request, user: db.User) -> web.Response:
 
     if room is not None:
         await sio.emit("close", room=room.room_id)
+    move_user(user.user_id, None)
 
     return web.json_response({})
 
@@ -186,16 +286,20 @@ async def broadcast_change(
     if room is None:
         return web.json_response({"error": "User not playing"})
 
-    if not await room.play(request, uri, data.get("position_ms", None)):
-        return web.json_response({"error": "Unable to change song"})
+    result = await room.play(request, uri, data.get("position_ms", None))
+    if not result:
+        return web.json_response(
+            dict(result.to_json(), error="Unable to change song")
+        )
 
+    request.app["pollers"].wake(room.room_id)
     await sio.emit(
         "changed",
-        {"number": len(await room.listeners), "playing": data},
+        {"number": await room.listener_count, "playing": data},
         room=room.room_id,
     )
 
-    return web.json_response({})
+    return web.json_response(result.to_json())
 
 
 #
@@ -222,8 +326,9 @@ async def listen_start(request: web.Request, user: db.User) -> web.Response:
     if data is None:
         return web.json_response({"error": "Unable to start listening"})
 
-    data = {"playing": data, "number": len(await room.listeners)}
-    await sio.emit("listeners", {"number": data["number"]}, room=room.room_id)
+    data = {"playing": data, "number": await room.listener_count}
+    move_user(user.user_id, room.room_id)
+    request.app["listener_broadcasts"].schedule(room.room_id)
 
     # It worked!
     return web.json_response(data)
@@ -237,13 +342,10 @@ async def listen_stop(request: web.Request, user: db.User) -> web.Response:
 
     room = await user.listening_to
     await user.stop(request)
+    move_user(user.user_id, None)
 
     if room is not None:
-        await sio.emit(
-            "listeners",
-            {"number": len(await room.listeners)},
-            room=room.room_id,
-        )
+        request.app["listener_broadcasts"].schedule(room.room_id)
 
     return web.json_response({})
 
@@ -0,0 +1,345 @@
+__all__ = [
+    "Counter",
+    "Histogram",
+    "Registry",
+    "registry",
+    "middleware",
+    "timed",
+]
+
+import abc
+import time
+from bisect import bisect_left
+from functools import wraps
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+from aiohttp import web
+
+DEFAULT_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+Labels = Tuple[str, ...]
+
+
+def format_labels(names: Sequence[str], values: Iterable[Any]) -> str:
+    pairs = [
+        '{0}="{1}"'.format(
+            name,
+            str(value)
+            .replace("\\", "\\\\")
+            .replace('"', '\\"')
+            .replace("\n", "\\n"),
+        )
+        for name, value in zip(names, values)
+    ]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric(abc.ABC):
+    type = "untyped"
+    constant_labels: Mapping[str, str] = {}
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+
+    def _key(self, labels: Mapping[str, Any]) -> Labels:
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def format_labels(
+        self, names: Sequence[str], values: Iterable[Any]
+    ) -> str:
+        constant = self.constant_labels
+        return format_labels(
+            tuple(constant) + tuple(names),
+            tuple(constant.values()) + tuple(values),
+        )
+
+    def header(self) -> List[str]:
+        return [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+
+    @abc.abstractmethod
+    def render(self) -> List[str]:
+        """The metric in the Prometheus text format, one line per item"""
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self.values: Dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for key, value in sorted(self.values.items()):
+            lines.append(
+                f"{self.name}{self.format_labels(self.labels, key)} {value}"
+            )
+        return lines
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        self.counts: Dict[Labels, List[int]] = {}
+        self.sums: Dict[Labels, float] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        counts = self.counts.get(key)
+        if counts is None:
+            counts = self.counts[key] = [0] * (len(self.buckets) + 1)
+            self.sums[key] = 0.0
+        counts[bisect_left(self.buckets, value)] += 1
+        self.sums[key] += value
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        names = self.labels + ("le",)
+        for key, counts in sorted(self.counts.items()):
+            total = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                total += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                bucket = self.format_labels(names, key + (le,))
+                lines.append(f"{self.name}_bucket{bucket} {total}")
+            labels = self.format_labels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {self.sums[key]}")
+            lines.append(f"{self.name}_count{labels} {total}")
+        return lines
+
+
+class Collector(Metric):
+    """A metric whose values are read from a callback at render time
+
+    The callback returns either a single number or a mapping from label values
+    to numbers.
+
+    """
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        func: Callable[[], Union[float, Mapping[Labels, float]]],
+        *,
+        labels: Sequence[str] = (),
+        type: str = "gauge",
+    ):
+        super().__init__(name, help, labels)
+        self.func = func
+        self.type = type
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        values = self.func()
+        if not isinstance(values, Mapping):
+            values = {(): values}
+        for key, value in sorted(values.items()):
+            lines.append(
+                f"{self.name}{self.format_labels(self.labels, key)} {value}"
+            )
+        return lines
+
+
+class Registry:
+    """The metrics of this process
+
+    The ``labels`` are added to every metric, such as the ``worker`` that
+    :func:`spotify_party.cluster.run_cluster` sets in each of its workers.
+
+    """
+
+    def __init__(self) -> None:
+        self.metrics: Dict[str, Metric] = {}
+        self.labels: Dict[str, str] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        metric.constant_labels = self.labels
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(
+        self, name: str, help: str, labels: Sequence[str] = ()
+    ) -> Counter:
+        metric = self.register(Counter(name, help, labels))
+        assert isinstance(metric, Counter)
+        return metric
+
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        metric = self.register(Histogram(name, help, labels, buckets))
+        assert isinstance(metric, Histogram)
+        return metric
+
+    def collector(
+        self,
+        name: str,
+        help: str,
+        func: Callable[[], Union[float, Mapping[Labels, float]]],
+        *,
+        labels: Sequence[str] = (),
+        type: str = "gauge",
+    ) -> Collector:
+        metric = self.register(
+            Collector(name, help, func, labels=labels, type=type)
+        )
+        assert isinstance(metric, Collector)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for name in sorted(self.metrics):
+            lines.extend(self.metrics[name].render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_request_duration = registry.histogram(
+    "http_request_duration_seconds",
+    "The time spent handling requests, by route name",
+    ("route",),
+)
+http_requests = registry.counter(
+    "http_requests_total", "The number of requests", ("route", "status")
+)
+spotify_request_duration = registry.histogram(
+    "spotify_request_duration_seconds",
+    "The time spent in calls to the Spotify API, including retries",
+    ("endpoint", "method"),
+)
+spotify_responses = registry.counter(
+    "spotify_responses_total",
+    "The number of responses from the Spotify API",
+    ("endpoint", "method", "status"),
+)
+sync_drift = registry.histogram(
+    "sync_drift_seconds",
+    "How far listeners were from the host when they synced",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+device_ready = registry.histogram(
+    "device_ready_seconds",
+    "How long devices took to become active after a transfer",
+    ("outcome",),
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0),
+)
+connection_wait = registry.histogram(
+    "spotify_connection_wait_seconds",
+    "How long requests to the Spotify hosts waited for a free connection",
+    ("host",),
+)
+database_query_duration = registry.histogram(
+    "database_query_duration_seconds",
+    "The time spent in each database method",
+    ("query",),
+)
+
+
+def get_route_name(request: web.Request) -> str:
+    route = request.match_info.route
+    if route.name is not None:
+        return route.name
+    if route.resource is not None:
+        return route.resource.canonical
+    return "unmatched"
+
+
+@web.middleware
+async def middleware(
+    request: web.Request, handler: Callable[[web.Request], Awaitable]
+) -> web.StreamResponse:
+    start = time.monotonic()
+    status = 500
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as ex:
+        status = ex.status
+        raise
+    finally:
+        route = get_route_name(request)
+        http_request_duration.observe(time.monotonic() - start, route=route)
+        http_requests.inc(route=route, status=status)
+
+
+def timed(
+    histogram: Histogram, **labels: Any
+) -> Callable[[Callable[..., Awaitable]], Callable[..., Awaitable]]:
+    """A decorator recording the run time of a coroutine function"""
+
+    def decorator(func: Callable[..., Awaitable]) -> Callable[..., Awaitable]:
+        @wraps(func)
+        async def wrapped(*args: Any, **kwargs: Any) -> Any:
+            start = time.monotonic()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                histogram.observe(time.monotonic() - start, **labels)
+
+        return wrapped
+
+    return decorator
+
+
+def observe_spotify(
+    endpoint: str, method: str, start: float, status: Optional[int]
+) -> None:
+    spotify_request_duration.observe(
+        time.monotonic() - start, endpoint=endpoint, method=method
+    )
+    spotify_responses.inc(
+        endpoint=endpoint,
+        method=method,
+        status="error" if status is None else status,
+    )
@@ -8,4 +8,4 @@ CREATE TABLE users (
     playing_to TEXT UNIQUE,
     paused INT DEFAULT 0,
     device_id TEXT
-)
+);
@@ -0,0 +1,45 @@
+CREATE INDEX users_listening_to ON users (listening_to, user_id);
+
+CREATE TABLE rooms (
+    room_id TEXT PRIMARY KEY,
+    host_id TEXT UNIQUE NOT NULL,
+    listener_count INT NOT NULL DEFAULT 0
+);
+
+INSERT INTO rooms (room_id, host_id, listener_count)
+SELECT
+    main.playing_to,
+    main.user_id,
+    (SELECT count(*) FROM users AS other
+     WHERE other.listening_to = main.playing_to)
+FROM users AS main
+WHERE main.playing_to IS NOT NULL;
+
+-- Keep the rooms table in sync with users.playing_to
+CREATE TRIGGER rooms_open AFTER UPDATE OF playing_to ON users
+WHEN NEW.playing_to IS NOT NULL AND NEW.playing_to IS NOT OLD.playing_to
+BEGIN
+    DELETE FROM rooms WHERE host_id = NEW.user_id;
+    INSERT INTO rooms (room_id, host_id, listener_count)
+    VALUES (
+        NEW.playing_to,
+        NEW.user_id,
+        (SELECT count(*) FROM users WHERE listening_to = NEW.playing_to)
+    );
+END;
+
+CREATE TRIGGER rooms_close AFTER UPDATE OF playing_to ON users
+WHEN OLD.playing_to IS NOT NULL AND NEW.playing_to IS NULL
+BEGIN
+    DELETE FROM rooms WHERE room_id = OLD.playing_to;
+END;
+
+-- Maintain the listener counts from users.listening_to
+CREATE TRIGGER rooms_listeners AFTER UPDATE OF listening_to ON users
+WHEN NEW.listening_to IS NOT OLD.listening_to
+BEGIN
+    UPDATE rooms SET listener_count = listener_count - 1
+    WHERE room_id = OLD.listening_to;
+    UPDATE rooms SET listener_count = listener_count + 1
+    WHERE room_id = NEW.listening_to;
+END;
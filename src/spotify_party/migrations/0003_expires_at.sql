@@ -0,0 +1 @@
+CREATE INDEX users_expires_at ON users (expires_at);
@@ -0,0 +1,354 @@
+__all__ = ["PlaybackSnapshot", "RoomPoller", "PollerRegistry"]
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from aiohttp import web
+
+from . import sync
+
+logger = logging.getLogger(__name__)
+
+# Position differences smaller than this (in ms) aren't reported as seeks
+SEEK_TOLERANCE = 2000
+
+
+def diff_playback(
+    old: Optional[Dict[str, Any]],
+    new: Optional[Dict[str, Any]],
+    elapsed_ms: float,
+) -> List[str]:
+    """Find the changes between two snapshots of the host's playback
+
+    Args:
+        old: The previous snapshot
+        new: The current snapshot
+        elapsed_ms (float): The time between the two snapshots
+
+    Returns:
+        List[str]: The changes, a subset of ``["track", "pause", "seek"]``
+
+    """
+    if old is None and new is None:
+        return []
+    if old is None or new is None:
+        return ["track"]
+
+    changes = []
+    if old.get("uri") != new.get("uri"):
+        changes.append("track")
+    if old.get("is_playing") != new.get("is_playing"):
+        changes.append("pause")
+    if not changes and new.get("position_ms") is not None:
+        expected = old.get("position_ms") or 0
+        if old.get("is_playing"):
+            expected += elapsed_ms
+        if abs(new["position_ms"] - expected) > SEEK_TOLERANCE:
+            changes.append("seek")
+    return changes
+
+
+class PlaybackSnapshot:
+    """The latest playback of a room's host, as of ``updated_at``
+
+    The times are from :func:`time.monotonic`, which the workers on a
+    machine share.
+
+    """
+
+    def __init__(
+        self,
+        state: Optional[Dict[str, Any]] = None,
+        updated_at: Optional[float] = None,
+        *,
+        max_interval: float = 10.0,
+    ):
+        self.state = state
+        self.updated_at = updated_at
+        self.max_interval = max_interval
+
+    @property
+    def fresh(self) -> bool:
+        return (
+            self.updated_at is not None
+            and time.monotonic() - self.updated_at < 2 * self.max_interval
+        )
+
+    def current(self) -> Optional[Dict[str, Any]]:
+        """The latest snapshot with the position projected to now"""
+        if self.state is None:
+            return None
+        return sync.project(self.state, time.monotonic() - self.updated_at)
+
+
+class RoomPoller(PlaybackSnapshot):
+    """A background task that follows the playback of a room's host
+
+    The host's ``currently-playing`` endpoint is polled once for the whole
+    room and any change is emitted to the room as a ``playback`` event. The
+    interval is reset to ``min_interval`` after a change and otherwise
+    doubles up to ``max_interval``, but a poll is always scheduled for the
+    expected end of the current track. While the polls fail, the interval
+    keeps doubling up to ``max_error_interval`` and only the first failure
+    is logged. ``on_poll`` is called with the poller after each poll.
+
+    """
+
+    max_error_interval = 300.0
+
+    def __init__(
+        self,
+        app: web.Application,
+        room_id: str,
+        host_id: str,
+        *,
+        emit: Callable[..., Awaitable],
+        min_interval: float = 1.0,
+        max_interval: float = 10.0,
+        on_poll: Optional[Callable[["RoomPoller"], None]] = None,
+    ):
+        super().__init__(max_interval=max_interval)
+        self.app = app
+        self.room_id = room_id
+        self.host_id = host_id
+        self.emit = emit
+        self.min_interval = min_interval
+        self.on_poll = on_poll
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Future] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    def wake(self) -> None:
+        self._wake.set()
+
+    def cancel(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def next_interval(self, interval: float, changed: bool) -> float:
+        if changed:
+            interval = self.min_interval
+        else:
+            interval = min(2 * interval, self.max_interval)
+
+        # Don't sleep through the end of the track
+        state = self.state
+        if (
+            state is not None
+            and state.get("is_playing")
+            and state.get("position_ms") is not None
+            and state.get("duration_ms") is not None
+        ):
+            remaining = 1e-3 * (state["duration_ms"] - state["position_ms"])
+            interval = min(interval, max(remaining, self.min_interval))
+
+        return interval
+
+    async def poll(self) -> Optional[List[str]]:
+        """Poll the host once and return the changes (None if closed)"""
+        room = await self.app["db"].get_room(self.room_id)
+        if room is None or room.host_id != self.host_id:
+            return None
+
+        state = await room.host.currently_playing(self.app)
+        now = time.monotonic()
+        elapsed_ms = (
+            0.0 if self.updated_at is None else 1000 * (now - self.updated_at)
+        )
+        changes = diff_playback(self.state, state, elapsed_ms)
+        self.state = state
+        self.updated_at = now
+        if self.on_poll is not None:
+            self.on_poll(self)
+
+        if changes:
+            await self.emit(
+                "playback",
+                {"playing": state, "changes": changes},
+                room=self.room_id,
+            )
+        return changes
+
+    async def _run(self) -> None:
+        interval = self.min_interval
+        failures = 0
+        while True:
+            self._wake.clear()
+            try:
+                changes = await self.poll()
+            except Exception:
+                if not failures:
+                    logger.exception(f"failed to poll room '{self.room_id}'")
+                failures += 1
+                changes = []
+            else:
+                if failures:
+                    logger.info(
+                        f"polled room '{self.room_id}' again after "
+                        f"{failures} failures"
+                    )
+                failures = 0
+            if changes is None:
+                break
+            if failures:
+                interval = min(
+                    self.max_interval * 2 ** (failures - 1),
+                    self.max_error_interval,
+                )
+            else:
+                interval = self.next_interval(interval, bool(changes))
+
+            try:
+                await asyncio.wait_for(self._wake.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+            else:
+                interval = self.min_interval
+
+
+class PollerRegistry:
+    """The running :class:`RoomPoller` tasks, keyed by room ID
+
+    With several workers, only one of them runs the pollers; the others set
+    ``forward`` to send it their ``start``, ``wake`` and ``stop`` commands,
+    which it runs with :meth:`handle`. It sets ``publish`` to send them each
+    poll's snapshot in turn (or ``None`` once a poller stops), which they
+    keep with :meth:`update` and return from :meth:`get`.
+
+    """
+
+    def __init__(
+        self,
+        app: web.Application,
+        *,
+        emit: Callable[..., Awaitable],
+        min_interval: float = 1.0,
+        max_interval: float = 10.0,
+    ):
+        self.app = app
+        self.emit = emit
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.pollers: Dict[str, RoomPoller] = {}
+        self.forward: Optional[Callable[[str, Tuple], None]] = None
+        self.publish: Optional[Callable[[Tuple], None]] = None
+        self.snapshots: Dict[str, PlaybackSnapshot] = {}
+
+    def __len__(self) -> int:
+        return len(self.pollers)
+
+    def _get_poller(self, room_id: Optional[str]) -> Optional[RoomPoller]:
+        if room_id is None:
+            return None
+        poller = self.pollers.get(room_id)
+        if poller is not None and not poller.running:
+            del self.pollers[room_id]
+            return None
+        return poller
+
+    def get(self, room_id: Optional[str]) -> Optional[PlaybackSnapshot]:
+        if room_id is not None and self.forward is not None:
+            return self.snapshots.get(room_id)
+        return self._get_poller(room_id)
+
+    def _polled(self, poller: RoomPoller) -> None:
+        if self.publish is not None:
+            self.publish((poller.room_id, poller.state, poller.updated_at))
+
+    def _removed(self, room_id: str) -> None:
+        if self.publish is not None:
+            self.publish((room_id, None, None))
+
+    def update(
+        self,
+        room_id: str,
+        state: Optional[Dict[str, Any]],
+        updated_at: Optional[float],
+    ) -> None:
+        """Keep a snapshot published by the worker that runs the pollers"""
+        if updated_at is None:
+            self.snapshots.pop(room_id, None)
+        else:
+            self.snapshots[room_id] = PlaybackSnapshot(
+                state, updated_at, max_interval=self.max_interval
+            )
+
+    def start(self, room_id: str, host_id: str) -> Optional[RoomPoller]:
+        if self.forward is not None:
+            self.forward("start", (room_id, host_id))
+            return None
+        poller = self._get_poller(room_id)
+        if poller is not None:
+            if poller.host_id == host_id:
+                poller.wake()
+                return poller
+            # The room has a new host, so the old poller has to go
+            poller.cancel()
+            self._removed(room_id)
+        poller = RoomPoller(
+            self.app,
+            room_id,
+            host_id,
+            emit=self.emit,
+            min_interval=self.min_interval,
+            max_interval=self.max_interval,
+            on_poll=self._polled,
+        )
+        self.pollers[room_id] = poller
+        poller.start()
+        return poller
+
+    def wake(self, room_id: Optional[str]) -> None:
+        if self.forward is not None:
+            if room_id is not None:
+                self.forward("wake", (room_id,))
+            return
+        poller = self._get_poller(room_id)
+        if poller is not None:
+            poller.wake()
+
+    async def stop(self, room_id: Optional[str]) -> None:
+        if room_id is None:
+            return
+        if self.forward is not None:
+            self.forward("stop", (room_id,))
+            self.snapshots.pop(room_id, None)
+            return
+        poller = self.pollers.pop(room_id, None)
+        if poller is not None:
+            await poller.stop()
+            self._removed(room_id)
+
+    async def handle(self, command: str, args: Tuple) -> None:
+        """Run a command forwarded by another worker"""
+        if command == "start":
+            self.start(*args)
+        elif command == "wake":
+            self.wake(*args)
+        elif command == "stop":
+            await self.stop(*args)
+
+    async def close(self) -> None:
+        await asyncio.gather(
+            *(poller.stop() for poller in self.pollers.values())
+        )
+        self.pollers.clear()
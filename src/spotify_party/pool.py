@@ -0,0 +1,151 @@
+__all__ = ["PoolStats", "create_session", "warm_up"]
+
+import asyncio
+import logging
+import time
+from types import SimpleNamespace
+from typing import Any, Dict, Mapping, Tuple
+
+import aiohttp
+import yarl
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class PoolStats:
+    """Per-host counters for the outgoing connection pool
+
+    These are collected through aiohttp's request tracing: the requests in
+    flight, the requests waiting for a free connection, and how many
+    connections were opened, reused or waited for. A host with requests
+    queued is at the pool's limit.
+
+    """
+
+    def __init__(self) -> None:
+        self.in_flight: Dict[str, int] = {}
+        self.queued: Dict[str, int] = {}
+        self.totals: Dict[Tuple[str, str], int] = {}
+
+    def gauges(self) -> Dict[Tuple[str, str], int]:
+        values = {}
+        for host, number in self.in_flight.items():
+            values[host, "in_flight"] = number
+            values[host, "queued"] = self.queued.get(host, 0)
+        return values
+
+    def count(self, host: str, outcome: str) -> None:
+        key = (host, outcome)
+        self.totals[key] = self.totals.get(key, 0) + 1
+
+    def trace_config(self) -> aiohttp.TraceConfig:
+        trace_config = aiohttp.TraceConfig()
+
+        # The connection signals don't include the URL, but each request
+        # shares its context between the signals
+        async def on_request_start(
+            session: aiohttp.ClientSession, context: SimpleNamespace, params
+        ) -> None:
+            context.host = params.url.host
+            self.in_flight[context.host] = (
+                self.in_flight.get(context.host, 0) + 1
+            )
+
+        async def on_request_end(
+            session: aiohttp.ClientSession, context: SimpleNamespace, params
+        ) -> None:
+            self.in_flight[context.host] -= 1
+
+        async def on_queued_start(
+            session: aiohttp.ClientSession, context: SimpleNamespace, params
+        ) -> None:
+            context.queued = time.monotonic()
+            self.queued[context.host] = self.queued.get(context.host, 0) + 1
+            self.count(context.host, "queued")
+
+        async def on_queued_end(
+            session: aiohttp.ClientSession, context: SimpleNamespace, params
+        ) -> None:
+            self.queued[context.host] -= 1
+            metrics.connection_wait.observe(
+                time.monotonic() - context.queued, host=context.host
+            )
+
+        async def on_create_end(
+            session: aiohttp.ClientSession, context: SimpleNamespace, params
+        ) -> None:
+            self.count(context.host, "created")
+
+        async def on_reuse(
+            session: aiohttp.ClientSession, context: SimpleNamespace, params
+        ) -> None:
+            self.count(context.host, "reused")
+
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_request_end.append(on_request_end)
+        trace_config.on_request_exception.append(on_request_end)
+        trace_config.on_connection_queued_start.append(on_queued_start)
+        trace_config.on_connection_queued_end.append(on_queued_end)
+        trace_config.on_connection_create_end.append(on_create_end)
+        trace_config.on_connection_reuseconn.append(on_reuse)
+        return trace_config
+
+
+def create_session(
+    config: Mapping[str, Any], stats: PoolStats
+) -> aiohttp.ClientSession:
+    """A client session with a connection pool sized for the Spotify API
+
+    Nearly all the requests go to the same two hosts, so the pool keeps
+    idle connections for longer than aiohttp's default (which is shorter
+    than the slowest polling interval) and caches the DNS lookups.
+
+    """
+    connector = aiohttp.TCPConnector(
+        limit=config["spotify_pool_size"],
+        limit_per_host=config["spotify_pool_size_per_host"],
+        keepalive_timeout=config["spotify_keepalive_timeout"],
+        ttl_dns_cache=config["spotify_dns_cache_ttl"],
+    )
+    return aiohttp.ClientSession(
+        connector=connector, trace_configs=[stats.trace_config()]
+    )
+
+
+async def warm_up(
+    session: aiohttp.ClientSession,
+    url: str,
+    number: int,
+    *,
+    timeout: float = 10.0,
+) -> int:
+    """Open ``number`` connections to the host of ``url`` ahead of time
+
+    The connections are opened with concurrent ``HEAD`` requests, whatever
+    their status, and then returned to the pool so that the first API calls
+    don't pay for the DNS lookup and TLS handshake.
+
+    Returns:
+        int: The number of requests that got a response
+
+    """
+    origin = yarl.URL(url).origin()
+
+    async def connect() -> None:
+        async with session.head(
+            origin, timeout=aiohttp.ClientTimeout(total=timeout)
+        ):
+            pass
+
+    results = await asyncio.gather(
+        *(connect() for _ in range(number)), return_exceptions=True
+    )
+    errors = [e for e in results if isinstance(e, Exception)]
+    if errors:
+        logger.warning(
+            f"couldn't open {len(errors)} of {number} connections to "
+            f"{origin.host}: {errors[0]}"
+        )
+    return number - len(errors)
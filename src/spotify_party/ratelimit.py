@@ -0,0 +1,217 @@
+__all__ = ["TokenBucket", "RateLimited", "RequestScheduler"]
+
+import asyncio
+import random
+import time
+from typing import Any, Callable, Dict, Optional
+
+from aiohttp import ClientSession, web
+from aiohttp_spotify import SpotifyAuth, SpotifyResponse
+
+# Retry these statuses, in addition to 429
+RETRY_STATUSES = (500, 502, 503, 504)
+
+
+class TokenBucket:
+    """A token bucket that hands out reservations instead of blocking
+
+    The bucket is allowed to go into debt so that each caller learns how long
+    it has to wait for its turn in a single O(1) step.
+
+    Args:
+        rate (float): The number of tokens added per second
+        burst (float): The capacity of the bucket
+
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.burst = max(1.0, rate if burst is None else burst)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(
+            self.burst, self.tokens + (now - self.updated) * self.rate
+        )
+        self.updated = now
+
+    @property
+    def full(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.burst and not self.blocked
+
+    @property
+    def blocked(self) -> bool:
+        return self.blocked_until > time.monotonic()
+
+    def reserve(self) -> float:
+        """Take a token and return the number of seconds to wait for it"""
+        now = time.monotonic()
+        self._refill(now)
+        self.tokens -= 1
+        delay = 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+        return max(delay, self.blocked_until - now)
+
+    def refund(self) -> None:
+        self.tokens = min(self.burst, self.tokens + 1)
+
+    def block(self, seconds: float) -> None:
+        self.blocked_until = max(
+            self.blocked_until, time.monotonic() + seconds
+        )
+
+
+class RateLimited(web.HTTPTooManyRequests):
+    """Raised when a call to the Spotify API is dropped by the scheduler"""
+
+
+class RequestScheduler:
+    """Schedule the calls to the Spotify API within the rate limits
+
+    Every call takes a token from a bucket for its access token. Spotify
+    limits each app as a whole too, but doesn't publish that limit, so the
+    calls are only held back globally once it answers with a 429: all of
+    them then wait for the ``Retry-After`` period, and the call is retried.
+    Server errors are retried with exponential backoff and jitter. Calls
+    that would wait longer than ``max_wait``, or that run out of retries,
+    are dropped with a :class:`RateLimited` error.
+
+    Args:
+        rate (float, optional): A global number of calls per second to stay
+            under ahead of any 429 response, or 0 for none
+        token_rate (float, optional): The number of calls per second for
+            each access token
+        max_retries (int, optional): The maximum number of retries per call
+        max_wait (float, optional): The longest time that a call can wait for
+            its turn, in seconds
+        backoff (float, optional): The base delay for the exponential backoff
+
+    """
+
+    max_buckets = 1024
+
+    def __init__(
+        self,
+        *,
+        rate: float = 0.0,
+        token_rate: float = 5.0,
+        max_retries: int = 3,
+        max_wait: float = 10.0,
+        backoff: float = 0.25,
+    ):
+        self.bucket = TokenBucket(rate) if rate > 0 else None
+        self.blocked_until = 0.0
+        self.token_rate = token_rate
+        self.max_retries = max_retries
+        self.max_wait = max_wait
+        self.backoff = backoff
+        self.buckets: Dict[str, TokenBucket] = {}
+        self.throttled = 0
+        self.retried = 0
+        self.dropped = 0
+
+    def stats(self) -> Dict[str, int]:
+        return dict(
+            throttled=self.throttled,
+            retried=self.retried,
+            dropped=self.dropped,
+        )
+
+    def _get_bucket(self, access_token: str) -> TokenBucket:
+        bucket = self.buckets.get(access_token)
+        if bucket is None:
+            if len(self.buckets) >= self.max_buckets:
+                self.buckets = {
+                    k: v for k, v in self.buckets.items() if not v.full
+                }
+            bucket = self.buckets[access_token] = TokenBucket(self.token_rate)
+        return bucket
+
+    def block(self, seconds: float) -> None:
+        self.blocked_until = max(
+            self.blocked_until, time.monotonic() + seconds
+        )
+
+    async def acquire(self, access_token: str) -> None:
+        buckets = [self._get_bucket(access_token)]
+        if self.bucket is not None:
+            buckets.append(self.bucket)
+        delay = max(bucket.reserve() for bucket in buckets)
+        delay = max(delay, self.blocked_until - time.monotonic())
+        if delay > self.max_wait:
+            for bucket in buckets:
+                bucket.refund()
+            self.dropped += 1
+            raise RateLimited(text="Too many requests to the Spotify API")
+        if delay > 0:
+            self.throttled += 1
+            await asyncio.sleep(delay)
+
+    def get_backoff(self, attempt: int) -> float:
+        return random.uniform(0, self.backoff * 2 ** attempt)
+
+    async def request(
+        self,
+        session: ClientSession,
+        api_url: str,
+        auth: SpotifyAuth,
+        endpoint: str,
+        *,
+        method: str = "GET",
+        observe: Optional[Callable[[float], None]] = None,
+        **kwargs: Any,
+    ) -> SpotifyResponse:
+        """Make a call, retrying as needed
+
+        If ``observe`` is given, it is called with the round trip time of the
+        successful attempt in seconds.
+
+        """
+        headers = {
+            "Accept": "application/json",
+            "Authorization": f"Bearer {auth.access_token}",
+        }
+        attempt = 0
+        while True:
+            await self.acquire(auth.access_token)
+            sent = time.monotonic()
+            async with session.request(
+                method, api_url + endpoint, headers=headers, **kwargs
+            ) as response:
+                if (
+                    response.status != 429
+                    and response.status not in RETRY_STATUSES
+                ):
+                    response.raise_for_status()
+                    if observe is not None:
+                        observe(time.monotonic() - sent)
+                    return SpotifyResponse(
+                        False,
+                        auth,
+                        response.status,
+                        response.headers,
+                        await response.read(),
+                    )
+
+                if attempt >= self.max_retries:
+                    self.dropped += 1
+                    response.raise_for_status()
+
+                if response.status == 429:
+                    self.throttled += 1
+                    try:
+                        delay = float(response.headers.get("Retry-After", 1))
+                    except ValueError:
+                        delay = 1.0
+                    self.block(delay)
+                    self._get_bucket(auth.access_token).block(delay)
+                    delay = 0.0
+                else:
+                    delay = self.get_backoff(attempt)
+
+            attempt += 1
+            self.retried += 1
+            if delay > 0:
+                await asyncio.sleep(delay)
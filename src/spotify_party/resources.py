@@ -0,0 +1,25 @@
+__all__ = ["get_path", "read_text"]
+
+import pathlib
+
+try:
+    from importlib.resources import files
+except ImportError:  # pragma: no cover
+    files = None
+
+
+def get_path(name: str) -> pathlib.Path:
+    """The path to a file or directory that is shipped with the package
+
+    The package isn't zip safe, so its resources are always real files.
+
+    """
+    if files is None:
+        root = pathlib.Path(__file__).parent
+    else:
+        root = pathlib.Path(str(files(__package__)))
+    return (root / name).resolve()
+
+
+def read_text(name: str) -> str:
+    return get_path(name).read_text(encoding="utf-8")
@@ -0,0 +1,110 @@
+__all__ = ["CachedEncryptedCookieStorage"]
+
+import hashlib
+import time
+from typing import Any, Mapping, Optional, Tuple
+
+from aiohttp import web
+from aiohttp_session import Session
+from aiohttp_session.cookie_storage import EncryptedCookieStorage
+
+from . import cache
+
+
+class CachedEncryptedCookieStorage(EncryptedCookieStorage):
+    """Encrypted cookie sessions that are only decrypted once per cookie
+
+    Most requests come from listeners syncing with the same cookie, so the
+    decoded sessions are kept in an LRU cache keyed by the digest of the
+    cookie. Sessions are never served past their ``max_age``. The cookies
+    that this storage sets are cached too, and when a session is saved with
+    the data that its cookie already holds, the cookie is not encrypted and
+    sent again (unless ``max_age`` is set, since that would let it expire).
+
+    Args:
+        cache_size (int, optional): The maximum number of cached sessions
+        cache_ttl (float, optional): How long a session stays cached, in
+            seconds
+
+    """
+
+    def __init__(
+        self,
+        secret_key: Any,
+        *,
+        cache_size: int = 1024,
+        cache_ttl: float = 300.0,
+        **kwargs: Any,
+    ):
+        super().__init__(secret_key, **kwargs)
+        self.cache = cache.LRUCache(maxsize=cache_size, ttl=cache_ttl)
+        self.unchanged = 0
+
+    def get_data(self, session: Session) -> Mapping[str, Any]:
+        # A copy, since the session's own mapping changes with the session
+        data = self._get_session_data(session)
+        return dict(data, session=dict(data["session"]))
+
+    def get_key(self, cookie: str) -> bytes:
+        return hashlib.sha256(cookie.encode("utf-8")).digest()
+
+    def get_cached(self, cookie: str) -> Optional[Mapping[str, Any]]:
+        key = self.get_key(cookie)
+        entry: Optional[Tuple[Mapping[str, Any], float]] = self.cache.get(key)
+        if entry is None:
+            return None
+        data, expires = entry
+        if expires <= time.time():
+            self.cache.invalidate(key)
+            return None
+        return data
+
+    def set_cached(
+        self, cookie: str, data: Mapping[str, Any], created: float
+    ) -> None:
+        expires = float("inf")
+        if self.max_age is not None:
+            expires = created + self.max_age
+        self.cache.set(self.get_key(cookie), (data, expires))
+
+    async def load_session(self, request: web.Request) -> Session:
+        cookie = self.load_cookie(request)
+        if cookie is None:
+            return await super().load_session(request)
+
+        data = self.get_cached(cookie)
+        if data is not None:
+            return Session(None, data=data, new=False, max_age=self.max_age)
+
+        session = await super().load_session(request)
+        if not session.new:
+            self.set_cached(
+                cookie,
+                self.get_data(session),
+                self._fernet.extract_timestamp(cookie.encode("utf-8")),
+            )
+        return session
+
+    async def save_session(
+        self,
+        request: web.Request,
+        response: web.StreamResponse,
+        session: Session,
+    ) -> None:
+        if session.empty:
+            return await super().save_session(request, response, session)
+
+        data = self.get_data(session)
+        cookie = self.load_cookie(request)
+        if (
+            self.max_age is None
+            and cookie is not None
+            and self.get_cached(cookie) == data
+        ):
+            self.unchanged += 1
+            return
+
+        await super().save_session(request, response, session)
+        self.set_cached(
+            response.cookies[self.cookie_name].value, data, time.time()
+        )
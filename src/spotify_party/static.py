@@ -0,0 +1,170 @@
+__all__ = ["Asset", "AssetManifest", "IMMUTABLE", "REVALIDATE"]
+
+import gzip
+import hashlib
+import mimetypes
+import pathlib
+from typing import Dict, Optional, Union
+
+from aiohttp import web
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+COMPRESSIBLE_TYPES = (
+    "text/",
+    "application/javascript",
+    "application/json",
+    "image/svg+xml",
+)
+
+# Fingerprinted URLs change with their content, so they can be kept forever
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+# Everything else is revalidated with its ETag on every use
+REVALIDATE = "no-cache"
+
+
+def accepts(request: web.Request, encoding: str) -> bool:
+    for item in request.headers.get("Accept-Encoding", "").split(","):
+        name, _, params = item.strip().partition(";")
+        if name.strip() == encoding:
+            return params.replace(" ", "") not in ("q=0", "q=0.0")
+    return False
+
+
+class Asset:
+    """A response body held in memory with its compressed variants
+
+    Args:
+        body (bytes): The uncompressed body
+        content_type (str): The MIME type
+        charset (str, optional): The charset for text bodies
+
+    """
+
+    __slots__ = ("content_type", "charset", "digest", "bodies")
+
+    def __init__(
+        self, body: bytes, content_type: str, charset: Optional[str] = None
+    ):
+        self.content_type = content_type
+        self.charset = charset
+        self.digest = hashlib.sha256(body).hexdigest()
+        self.bodies: Dict[str, bytes] = {}
+        if content_type.startswith(COMPRESSIBLE_TYPES):
+            if brotli is not None:
+                self._add("br", brotli.compress(body), len(body))
+            self._add("gzip", gzip.compress(body, mtime=0), len(body))
+        self.bodies["identity"] = body
+
+    def _add(self, encoding: str, body: bytes, size: int) -> None:
+        if len(body) < size:
+            self.bodies[encoding] = body
+
+    def get_etag(self, encoding: str) -> str:
+        return f'"{self.digest[:16]}-{encoding}"'
+
+    def is_fresh(self, request: web.Request) -> bool:
+        """Does the client's cached copy (in any encoding) match?"""
+        header = request.headers.get("If-None-Match")
+        if header is None:
+            return False
+        tags = {tag.strip() for tag in header.split(",")}
+        tags.update(tag[2:] for tag in list(tags) if tag.startswith("W/"))
+        return "*" in tags or any(
+            self.get_etag(encoding) in tags for encoding in self.bodies
+        )
+
+    def respond(
+        self, request: web.Request, cache_control: str
+    ) -> web.Response:
+        encoding = "identity"
+        for name in self.bodies:
+            if name != "identity" and accepts(request, name):
+                encoding = name
+                break
+
+        headers = {
+            "Cache-Control": cache_control,
+            "ETag": self.get_etag(encoding),
+        }
+        if len(self.bodies) > 1:
+            headers["Vary"] = "Accept-Encoding"
+        if self.is_fresh(request):
+            return web.Response(status=304, headers=headers)
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return web.Response(
+            body=self.bodies[encoding],
+            content_type=self.content_type,
+            charset=self.charset,
+            headers=headers,
+        )
+
+
+class AssetManifest:
+    """The static assets, loaded into memory and fingerprinted
+
+    Each file is served from memory at ``<prefix>/<stem>.<hash>.<ext>`` with
+    a long-lived ``Cache-Control`` header, and at its plain name for links
+    that can't be rewritten (like the files that the frontend bundle loads
+    itself). Text files are compressed ahead of time with gzip, and with
+    brotli if the ``brotli`` package is installed.
+
+    Args:
+        root: The directory of built assets
+        prefix (str, optional): The URL path where the assets are served
+
+    """
+
+    def __init__(
+        self, root: Union[str, pathlib.Path], *, prefix: str = "/assets"
+    ):
+        self.root = pathlib.Path(root)
+        self.prefix = prefix
+        self.assets: Dict[str, Asset] = {}
+        self.fingerprints: Dict[str, str] = {}
+        self._urls: Dict[str, str] = {}
+
+    def load(self) -> None:
+        assets = {}
+        fingerprints = {}
+        for path in sorted(self.root.rglob("*")):
+            if not path.is_file():
+                continue
+            name = path.relative_to(self.root).as_posix()
+            content_type, _ = mimetypes.guess_type(name)
+            if content_type is None:
+                content_type = "application/octet-stream"
+            charset = "utf-8" if content_type.startswith("text/") else None
+            asset = assets[name] = Asset(
+                path.read_bytes(), content_type, charset
+            )
+
+            stem, dot, ext = name.rpartition(".")
+            if dot and "/" not in ext:
+                fingerprinted = f"{stem}.{asset.digest[:12]}.{ext}"
+            else:
+                fingerprinted = f"{name}.{asset.digest[:12]}"
+            fingerprints[fingerprinted] = name
+
+        self.assets = assets
+        self.fingerprints = fingerprints
+        self._urls = {name: key for key, name in fingerprints.items()}
+
+    def url(self, name: str) -> str:
+        """The URL for an asset, fingerprinted if it exists"""
+        return f"{self.prefix}/{self._urls.get(name, name)}"
+
+    async def handle(self, request: web.Request) -> web.Response:
+        filename = request.match_info["filename"]
+        name = self.fingerprints.get(filename)
+        if name is not None:
+            return self.assets[name].respond(request, IMMUTABLE)
+        asset = self.assets.get(filename)
+        if asset is None:
+            raise web.HTTPNotFound()
+        return asset.respond(request, REVALIDATE)
@@ -0,0 +1,244 @@
+__all__ = ["STATS_ROOM", "RoomStats", "StatsAggregator"]
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+)
+
+logger = logging.getLogger(__name__)
+
+# The socket.io room of the admins watching the live statistics
+STATS_ROOM = "admin:stats"
+
+
+class RoomStats:
+    __slots__ = ("room_id", "host_id", "host_name", "listeners", "peak")
+
+    def __init__(self, room_id: str, host_id: str, host_name: str):
+        self.room_id = room_id
+        self.host_id = host_id
+        self.host_name = host_name
+        self.listeners: Dict[str, str] = {}
+        self.peak = 0
+
+    @property
+    def room_name(self) -> str:
+        return self.room_id.split("/", 1)[-1]
+
+    @property
+    def listener_count(self) -> int:
+        return len(self.listeners)
+
+    def to_json(self) -> Dict[str, Any]:
+        return dict(
+            room_id=self.room_id,
+            host_id=self.host_id,
+            host_name=self.host_name,
+            listeners=self.listener_count,
+            peak=self.peak,
+        )
+
+
+class StatsAggregator:
+    """Live statistics about the rooms, without querying the database
+
+    The open rooms and their listeners are loaded once at startup and then
+    follow the ``add_room``, ``listen_to``, ``stop`` and ``close_room``
+    mutations (including those relayed from the other workers), so every
+    number can be read in constant time. Joins and leaves are counted over
+    the last ``window`` seconds.
+
+    Changes are sent to the admins in the ``STATS_ROOM`` socket.io room,
+    coalesced over ``delay`` seconds. Every worker sees every mutation, so
+    each one only sends the events to its own sockets.
+
+    Args:
+        emit: The socket.io server's ``emit`` coroutine function
+        delay (float, optional): How long changes are collected before they
+            are sent, in seconds
+        window (float, optional): The period of the join and leave rates, in
+            seconds
+
+    """
+
+    def __init__(
+        self,
+        *,
+        emit: Optional[Callable[..., Awaitable]] = None,
+        delay: float = 1.0,
+        window: float = 60.0,
+    ):
+        self.emit = emit
+        self.delay = delay
+        self.window = window
+        self.rooms: Dict[str, RoomStats] = {}
+        self.hosting: Dict[str, str] = {}
+        self.listening: Dict[str, str] = {}
+        self.joins: Deque[float] = deque()
+        self.leaves: Deque[float] = deque()
+        self._changed: Set[str] = set()
+        self._pending: Optional[asyncio.Future] = None
+
+    def __len__(self) -> int:
+        return len(self.rooms)
+
+    def get(self, room_id: str) -> Optional[RoomStats]:
+        return self.rooms.get(room_id)
+
+    @property
+    def listener_count(self) -> int:
+        return len(self.listening)
+
+    def get_rate(self, events: Deque[float]) -> float:
+        """The number of events per minute over the window"""
+        cutoff = time.monotonic() - self.window
+        while events and events[0] < cutoff:
+            events.popleft()
+        return 60.0 * len(events) / self.window
+
+    @property
+    def joins_per_minute(self) -> float:
+        return self.get_rate(self.joins)
+
+    @property
+    def leaves_per_minute(self) -> float:
+        return self.get_rate(self.leaves)
+
+    def summary(self) -> Dict[str, Any]:
+        return dict(
+            rooms=len(self.rooms),
+            listeners=self.listener_count,
+            joins_per_minute=self.joins_per_minute,
+            leaves_per_minute=self.leaves_per_minute,
+        )
+
+    def load(self, rows: Iterable[Sequence]) -> None:
+        """Load the rooms from ``Database.get_room_members``"""
+        self.rooms.clear()
+        self.hosting.clear()
+        self.listening.clear()
+        rows = list(rows)
+        for user_id, display_name, listening_to, playing_to in rows:
+            if playing_to is not None:
+                self.open_room(user_id, display_name, playing_to)
+        for user_id, display_name, listening_to, playing_to in rows:
+            room = self.rooms.get(listening_to)
+            if playing_to is None and room is not None:
+                room.listeners[user_id] = display_name
+                room.peak = max(room.peak, room.listener_count)
+                self.listening[user_id] = listening_to
+
+    def open_room(self, host_id: str, host_name: str, room_id: str) -> None:
+        # A host only has one room at a time
+        previous = self.hosting.get(host_id)
+        if previous is not None and previous != room_id:
+            self.close_room(previous)
+        self.rooms[room_id] = RoomStats(room_id, host_id, host_name)
+        self.hosting[host_id] = room_id
+        self.changed(room_id)
+
+    def close_room(self, room_id: str) -> None:
+        room = self.rooms.pop(room_id, None)
+        if room is None:
+            return
+        self.hosting.pop(room.host_id, None)
+        now = time.monotonic()
+        for user_id in room.listeners:
+            self.listening.pop(user_id, None)
+            self.leaves.append(now)
+        self.changed(room_id)
+
+    def join(self, user_id: str, display_name: str, room_id: str) -> None:
+        if self.listening.get(user_id) == room_id:
+            return
+        self.leave(user_id)
+        room = self.rooms.get(room_id)
+        if room is None:
+            return
+        room.listeners[user_id] = display_name
+        room.peak = max(room.peak, room.listener_count)
+        self.listening[user_id] = room_id
+        self.joins.append(time.monotonic())
+        self.changed(room_id)
+
+    def leave(self, user_id: str) -> None:
+        room_id = self.listening.pop(user_id, None)
+        if room_id is None:
+            return
+        room = self.rooms.get(room_id)
+        if room is not None:
+            room.listeners.pop(user_id, None)
+        self.leaves.append(time.monotonic())
+        self.changed(room_id)
+
+    def observe(self, event: str, args: Tuple) -> None:
+        """Follow the rooms through the database's mutation events"""
+        if event == "add_room":
+            host_id, room_id, host_name = args
+            self.open_room(host_id, host_name, room_id)
+        elif event == "listen_to":
+            user_id, room_id, display_name = args
+            self.join(user_id, display_name, room_id)
+        elif event == "stop":
+            (user_id,) = args
+            self.leave(user_id)
+            room_id = self.hosting.get(user_id)
+            if room_id is not None:
+                self.close_room(room_id)
+        elif event == "close_room":
+            (room_id,) = args
+            self.close_room(room_id)
+
+    def changed(self, room_id: str) -> None:
+        if self.emit is None:
+            return
+        self._changed.add(room_id)
+        if self._pending is None:
+            self._pending = asyncio.ensure_future(self._send())
+
+    async def _send(self) -> None:
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self._pending = None
+        changed, self._changed = self._changed, set()
+        rooms: Dict[str, Optional[Dict[str, Any]]] = {}
+        for room_id in changed:
+            room = self.rooms.get(room_id)
+            rooms[room_id] = None if room is None else room.to_json()
+        try:
+            # The other workers send the same numbers to their own sockets
+            await self.emit(
+                "stats",
+                {"summary": self.summary(), "rooms": rooms},
+                room=STATS_ROOM,
+                ignore_queue=True,
+            )
+        except Exception:
+            logger.exception("failed to send the room statistics")
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Everything, for an admin who starts watching"""
+        rooms = {
+            room_id: room.to_json() for room_id, room in self.rooms.items()
+        }
+        return {"summary": self.summary(), "rooms": rooms}
+
+    async def close(self) -> None:
+        task = self._pending
+        if task is None:
+            return
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
@@ -0,0 +1,101 @@
+__all__ = ["LatencyTracker", "stamp", "project", "advance", "get_drift"]
+
+import statistics
+import time
+from collections import OrderedDict, deque
+from typing import (
+    Any,
+    Awaitable,
+    Deque,
+    Dict,
+    Mapping,
+    Optional,
+    Tuple,
+    TypeVar,
+)
+
+T = TypeVar("T")
+
+
+class LatencyTracker:
+    """A rolling estimate of each user's latency to the Spotify API
+
+    The one-way latency is estimated as half of the median of the last
+    ``window`` round trip times, which is robust to the occasional slow call.
+
+    Args:
+        window (int, optional): The number of round trips kept per user
+
+    """
+
+    max_users = 4096
+
+    def __init__(self, window: int = 16):
+        self.window = window
+        self.samples: "OrderedDict[str, Deque[float]]" = OrderedDict()
+
+    def record(self, user_id: str, rtt: float) -> None:
+        samples = self.samples.pop(user_id, None)
+        if samples is None:
+            samples = deque(maxlen=self.window)
+        samples.append(rtt)
+        self.samples[user_id] = samples
+        if len(self.samples) > self.max_users:
+            self.samples.popitem(last=False)
+
+    def one_way(self, user_id: str) -> float:
+        samples = self.samples.get(user_id)
+        if not samples:
+            return 0.0
+        return 0.5 * statistics.median(samples)
+
+
+async def stamp(awaitable: Awaitable[T]) -> Tuple[T, float]:
+    """Await a result and note the (monotonic) time when it arrived"""
+    result = await awaitable
+    return result, time.monotonic()
+
+
+def project(
+    state: Optional[Mapping[str, Any]], elapsed: float
+) -> Optional[Dict[str, Any]]:
+    """Move a playback snapshot forward by ``elapsed`` seconds"""
+    if state is None:
+        return None
+    state = dict(state)
+    if state.get("is_playing") and state.get("position_ms") is not None:
+        state["position_ms"] = int(state["position_ms"] + 1000 * elapsed)
+        if state.get("duration_ms") is not None:
+            state["position_ms"] = min(
+                state["position_ms"], state["duration_ms"]
+            )
+    return state
+
+
+def advance(data: Mapping[str, Any], elapsed: float) -> Mapping[str, Any]:
+    """Move the position of a ``/me/player/play`` request forward"""
+    if data.get("position_ms") is None:
+        return data
+    return dict(data, position_ms=int(data["position_ms"] + 1000 * elapsed))
+
+
+def get_drift(
+    host: Optional[Mapping[str, Any]], listener: Optional[Mapping[str, Any]]
+) -> Optional[int]:
+    """How far the listener is ahead of the host, in ms
+
+    Both snapshots must be projected to the same time. This is ``None`` if
+    the listener isn't playing the host's track in the same state.
+
+    """
+    if host is None or listener is None:
+        return None
+    if (
+        host.get("uri") is None
+        or host.get("uri") != listener.get("uri")
+        or host.get("is_playing") != listener.get("is_playing")
+        or host.get("position_ms") is None
+        or listener.get("position_ms") is None
+    ):
+        return None
+    return listener["position_ms"] - host["position_ms"]
@@ -0,0 +1,136 @@
+__all__ = ["TokenManager"]
+
+import asyncio
+import logging
+import time
+from typing import TYPE_CHECKING, Dict
+
+from aiohttp import web
+from aiohttp_spotify import SpotifyAuth
+
+if TYPE_CHECKING:
+    from .db import User
+
+logger = logging.getLogger(__name__)
+
+# Tokens with less than this many seconds left are refreshed before use
+BLOCKING_MARGIN = 60
+
+
+class TokenManager:
+    """Refresh the users' access tokens with at most one refresh per user
+
+    Concurrent callers for the same user await the same in-flight refresh.
+    Tokens that expire within ``refresh_margin`` seconds are refreshed in the
+    background while the current token is still used, and :func:`run`
+    refreshes the tokens of everyone in an active room ahead of time so that
+    requests almost never wait for the token endpoint.
+
+    Args:
+        app (web.Application): The main app
+        refresh_margin (float, optional): Refresh tokens that expire within
+            this many seconds
+        interval (float, optional): The number of seconds between background
+            refresh passes
+
+    """
+
+    def __init__(
+        self,
+        app: web.Application,
+        *,
+        refresh_margin: float = 600.0,
+        interval: float = 60.0,
+    ):
+        self.app = app
+        self.refresh_margin = refresh_margin
+        self.interval = interval
+        self.refreshes = 0
+        self.coalesced = 0
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    @property
+    def window(self) -> float:
+        """Tokens that expire within this many seconds are refreshed
+
+        This covers the time until the next background pass, so that no
+        token gets within ``refresh_margin`` of expiring in between.
+
+        """
+        return self.refresh_margin + self.interval
+
+    async def _refresh(self, user: "User") -> SpotifyAuth:
+        # Another worker (or a request that we missed) might have already
+        # refreshed this token
+        current = await self.app["db"].get_user(user.user_id)
+        if current is not None and (
+            current.auth.expires_at - time.time() > self.window
+        ):
+            return current.auth
+
+        auth = await self.app["spotify_app"]["spotify_client"].update_auth(
+            self.app["client_session"], user.auth
+        )
+        self.refreshes += 1
+        await self.app["db"].update_auth(user, auth)
+        return auth
+
+    def _start(self, user: "User") -> asyncio.Future:
+        task = self._inflight.get(user.user_id)
+        if task is not None:
+            self.coalesced += 1
+            return task
+
+        task = asyncio.ensure_future(self._refresh(user))
+        self._inflight[user.user_id] = task
+
+        def done(task: asyncio.Future) -> None:
+            self._inflight.pop(user.user_id, None)
+            if not task.cancelled() and task.exception() is not None:
+                logger.error(
+                    f"failed to refresh the token for '{user.user_id}'",
+                    exc_info=task.exception(),
+                )
+
+        task.add_done_callback(done)
+        return task
+
+    async def refresh(self, user: "User") -> SpotifyAuth:
+        """Refresh the user's token now, or join a refresh in flight"""
+        return await asyncio.shield(self._start(user))
+
+    async def ensure_fresh(self, user: "User") -> bool:
+        """Make sure that a user's token can be used
+
+        Returns:
+            bool: True if ``user.auth`` was replaced with a new token
+
+        """
+        remaining = user.auth.expires_at - time.time()
+        if remaining > self.refresh_margin:
+            return False
+
+        if remaining > BLOCKING_MARGIN:
+            self._start(user)
+            return False
+
+        auth = await self.refresh(user)
+        changed = auth != user.auth
+        user.auth = auth
+        return changed
+
+    async def refresh_active(self) -> None:
+        """Refresh the soon to expire tokens of users in active rooms"""
+        before = time.time() + self.window
+        users = await self.app["db"].get_expiring_users(before)
+        await asyncio.gather(
+            *(self.refresh(user) for user in users), return_exceptions=True
+        )
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await self.refresh_active()
+            except Exception:
+                logger.exception("failed to refresh the active tokens")
+            await asyncio.sleep(self.interval)
@@ -6,8 +6,8 @@ import aiohttp_jinja2
 import aiohttp_session
 from aiohttp import web
 
-from . import api, db, interface
-from .generate_room_name import generate_room_name
+from . import api, db, interface, static
+from .metrics import registry
 
 routes = web.RouteTableDef()
 
@@ -17,21 +17,46 @@ routes = web.RouteTableDef()
 #
 
 
+# These pages are the same for everyone, so they're rendered once at startup
+PAGES = {
+    "splash.html": {},
+    "about.html": {"current_page": "about"},
+    "premium.html": {},
+}
+
+
+def render_pages(app: web.Application) -> None:
+    env = aiohttp_jinja2.get_env(app)
+    app["pages"] = {
+        name: static.Asset(
+            env.get_template(name).render(context).encode("utf-8"),
+            "text/html",
+            "utf-8",
+        )
+        for name, context in PAGES.items()
+    }
+
+
+def render_page(request: web.Request, name: str) -> web.Response:
+    pages = request.app.get("pages")
+    if pages is None:
+        return aiohttp_jinja2.render_template(name, request, PAGES[name])
+    return pages[name].respond(request, static.REVALIDATE)
+
+
 @routes.get("/", name="index")
 async def index(request: web.Request) -> web.Response:
-    return aiohttp_jinja2.render_template("splash.html", request, {})
+    return render_page(request, "splash.html")
 
 
 @routes.get("/about", name="about")
 async def about(request: web.Request) -> web.Response:
-    return aiohttp_jinja2.render_template(
-        "about.html", request, {"current_page": "about"}
-    )
+    return render_page(request, "about.html")
 
 
 @routes.get("/premium", name="premium")
 async def premium(request: web.Request) -> web.Response:
-    return aiohttp_jinja2.render_template("premium.html", request, {})
+    return render_page(request, "premium.html")
 
 
 @routes.get("/login", name="login")
@@ -67,7 +92,8 @@ async def play(request: web.Request, user: db.User) -> web.Response:
 
     # Generate a new room name or close the old one
     if room_id is None:
-        room_name = generate_room_name()
+        room_name = request.app["room_names"].allocate()
+        request.app["db"].notify("hold_room_name", (room_name,))
     else:
         await interface.sio.emit("close", room=room_id)
         room_name = room_id.split("/")[1]
@@ -117,9 +143,23 @@ async def listen(request: web.Request, user: db.User) -> web.Response:
 @routes.get("/admin", name="admin")
 @api.require_auth(admin=True)
 async def admin(request: web.Request, user: db.User) -> web.Response:
-    stats = await request.app["db"].get_room_stats()
+    stats = request.app["stats"]
     return aiohttp_jinja2.render_template(
-        "admin.html", request, {"stats": stats}
+        "admin.html",
+        request,
+        {
+            "summary": stats.summary(),
+            "rooms": stats.rooms.values(),
+            "connections": interface.connections.counts(),
+        },
+    )
+
+
+@routes.get("/metrics", name="metrics")
+@api.require_auth(admin=True)
+async def metrics(request: web.Request, user: db.User) -> web.Response:
+    return web.Response(
+        text=registry.render(), content_type="text/plain", charset="utf-8"
     )
 
 
@@ -129,13 +169,11 @@ async def admin_room(request: web.Request, user: db.User) -> web.Response:
     room_id = (
         f"{request.match_info['user_id']}/{request.match_info['room_name']}"
     )
-    room = await request.app["db"].get_room(room_id)
+    room = request.app["stats"].get(room_id)
     if room is None:
         return web.HTTPNotFound()
     return aiohttp_jinja2.render_template(
-        "admin.room.html",
-        request,
-        {"room": room, "listeners": await room.listeners},
+        "admin.room.html", request, {"room": room}
     )
 
 
@@ -157,6 +195,9 @@ async def error_middleware(
         error_code = ex.status
         if error_code < 400:
             raise
+        # The API's clients expect its errors in JSON
+        if request.path.startswith("/api/"):
+            return web.json_response({"error": ex.text}, status=error_code)
     return aiohttp_jinja2.render_template(
         "error.html", request, {"error_code": error_code}
     )
@@ -0,0 +1,46 @@
+import asyncio
+
+from spotify_party.cache import SingleFlightCache
+
+
+def test_waiter_retries_when_the_call_is_cancelled() -> None:
+    async def run() -> None:
+        cache = SingleFlightCache()
+        calls = []
+
+        async def call() -> str:
+            calls.append(None)
+            await asyncio.sleep(0.01 if len(calls) > 1 else 10)
+            return "result"
+
+        leader = asyncio.ensure_future(cache.get("key", call))
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(cache.get("key", call))
+        await asyncio.sleep(0)
+        leader.cancel()
+
+        result, _ = await waiter
+        assert result == "result"
+        assert len(calls) == 2
+        assert leader.cancelled()
+
+    asyncio.run(run())
+
+
+def test_waiter_gets_the_call_error() -> None:
+    async def run() -> None:
+        cache = SingleFlightCache()
+
+        async def call() -> str:
+            await asyncio.sleep(0.01)
+            raise ValueError("failed")
+
+        results = await asyncio.gather(
+            cache.get("key", call),
+            cache.get("key", call),
+            return_exceptions=True,
+        )
+        assert all(isinstance(result, ValueError) for result in results)
+        assert cache.coalesced == 1
+
+    asyncio.run(run())
@@ -0,0 +1,192 @@
+import asyncio
+import pathlib
+import sqlite3
+from typing import Dict, Tuple
+
+import pytest
+from aiohttp_spotify import SpotifyAuth
+
+from spotify_party import db
+
+# The schema before it was versioned, which databases can be upgraded from
+BASELINE_SCHEMA = """
+CREATE TABLE users (
+    user_id TEXT PRIMARY KEY,
+    display_name TEXT,
+    access_token TEXT,
+    refresh_token TEXT,
+    expires_at INT,
+    listening_to TEXT,
+    playing_to TEXT UNIQUE,
+    paused INT DEFAULT 0,
+    device_id TEXT
+)
+"""
+
+
+def get_auth(token: str = "token") -> SpotifyAuth:
+    return SpotifyAuth(token, "refresh", 2000000000)
+
+
+def get_database(path: pathlib.Path, **kwargs) -> db.Database:
+    filename = path / "test.db"
+    db.create_tables(filename)
+    return db.Database(filename, **kwargs)
+
+
+def test_failing_batch_only_rolls_back_itself(tmp_path: pathlib.Path) -> None:
+    async def run() -> None:
+        database = get_database(tmp_path, commit_delay=0.05)
+        await database.connect()
+
+        async def fail() -> None:
+            async with database._write(("user", "a")) as batch:
+                batch.execute(
+                    "UPDATE users SET display_name=? WHERE user_id=?",
+                    ("changed", "a"),
+                )
+                batch.execute("INSERT INTO missing VALUES (1)")
+
+        user, error = await asyncio.gather(
+            database.add_user("a", "a", get_auth()),
+            fail(),
+            return_exceptions=True,
+        )
+        assert isinstance(error, sqlite3.OperationalError)
+        assert user.display_name == "a"
+        assert (database.commits, database.batches) == (1, 2)
+        await database.close()
+
+    asyncio.run(run())
+
+
+def test_raising_transaction_writes_nothing(tmp_path: pathlib.Path) -> None:
+    async def run() -> None:
+        database = get_database(tmp_path)
+        await database.connect()
+
+        with pytest.raises(RuntimeError):
+            async with database.transaction():
+                await database.add_user("a", "a", get_auth())
+                async with database.transaction():
+                    await database.add_user("b", "b", get_auth())
+                # The writes wait for the end of the block
+                assert await database.get_user("a") is None
+                raise RuntimeError("failed")
+
+        assert await database.get_user("a") is None
+        assert await database.get_user("b") is None
+        assert database.commits == 0
+        await database.close()
+
+    asyncio.run(run())
+
+
+def test_transaction_only_includes_its_own_task(
+    tmp_path: pathlib.Path,
+) -> None:
+    async def run() -> None:
+        database = get_database(tmp_path)
+        await database.connect()
+
+        with pytest.raises(RuntimeError):
+            async with database.transaction():
+                user = await asyncio.ensure_future(
+                    database.add_user("a", "a", get_auth())
+                )
+                assert user is not None
+                raise RuntimeError("failed")
+
+        assert await database.get_user("a") is not None
+        await database.close()
+
+    asyncio.run(run())
+
+
+def test_commit_invalidates_the_cache(tmp_path: pathlib.Path) -> None:
+    async def run() -> None:
+        database = get_database(tmp_path)
+        await database.connect()
+
+        user = await database.add_user("a", "a", get_auth())
+        assert await database.get_user("a") is not None
+        version = database.cache.version
+        await database.update_auth(user, get_auth("new"))
+        assert database.cache.version > version
+        user = await database.get_user("a")
+        assert user.auth.access_token == "new"
+        await database.close()
+
+    asyncio.run(run())
+
+
+def get_listener_counts(filename: pathlib.Path) -> Dict[str, Tuple[int, int]]:
+    """The rooms' listener counts, and the actual numbers of listeners"""
+    with sqlite3.connect(filename) as connection:
+        return {
+            room_id: (count, actual)
+            for room_id, count, actual in connection.execute(
+                """
+                SELECT room_id, listener_count, (
+                    SELECT count(*) FROM users WHERE listening_to=room_id
+                )
+                FROM rooms
+                """
+            )
+        }
+
+
+def test_upgraded_database_counts_listeners(tmp_path: pathlib.Path) -> None:
+    filename = tmp_path / "test.db"
+    with sqlite3.connect(filename) as connection:
+        connection.executescript(BASELINE_SCHEMA)
+        connection.executemany(
+            "INSERT INTO users (user_id, listening_to, playing_to) "
+            "VALUES (?, ?, ?)",
+            [
+                ("host", None, "host/rock"),
+                ("a", "host/rock", None),
+                ("b", "host/rock", None),
+                ("c", None, None),
+            ],
+        )
+    db.create_tables(filename)
+
+    with sqlite3.connect(filename) as connection:
+        (version,) = connection.execute("PRAGMA user_version").fetchone()
+    assert version == db.SCHEMA_VERSION
+    assert get_listener_counts(filename) == {"host/rock": (2, 2)}
+
+    async def run() -> None:
+        database = db.Database(filename)
+        await database.connect()
+
+        async def add_room(user_id: str, room_id: str) -> None:
+            user = await database.get_user(user_id)
+            await database.add_room(user, room_id)
+
+        # Each step is followed by the expected (count, actual) per room
+        steps = [
+            (
+                lambda: database.listen_to("c", "host/rock"),
+                {"host/rock": (3, 3)},
+            ),
+            (lambda: database.stop("a"), {"host/rock": (2, 2)}),
+            (lambda: database.stop("host"), {}),
+            (lambda: add_room("host", "host/rock"), {"host/rock": (2, 2)}),
+            (lambda: add_room("host", "host/jazz"), {"host/jazz": (0, 0)}),
+            (
+                lambda: database.listen_to("b", "host/jazz"),
+                {"host/jazz": (1, 1)},
+            ),
+            (
+                lambda: add_room("a", "host/rock"),
+                {"host/jazz": (1, 1), "host/rock": (1, 1)},
+            ),
+        ]
+        for step, expected in steps:
+            await step()
+            assert get_listener_counts(filename) == expected
+        await database.close()
+
+    asyncio.run(run())
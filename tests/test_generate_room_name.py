@@ -0,0 +1,68 @@
+import random
+import time
+from typing import List
+
+import pytest
+
+from spotify_party.generate_room_name import RoomNameAllocator
+
+
+@pytest.fixture
+def clock(monkeypatch: pytest.MonkeyPatch) -> List[float]:
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_allocated_names_are_free() -> None:
+    allocator = RoomNameAllocator(rng=random.Random(0))
+    in_use = {
+        allocator.get_name(index) for index in range(0, allocator.base_size, 2)
+    }
+    allocator.load(f"host/{name}" for name in in_use)
+    assert allocator.tiers == 1
+
+    names = [allocator.allocate() for _ in range(1000)]
+    assert len(set(names)) == len(names)
+    assert not in_use.intersection(names)
+    # Past max_load, the names with a number are offered too
+    assert allocator.tiers == 2
+
+
+def test_opened_rooms_stay_taken(clock: List[float]) -> None:
+    allocator = RoomNameAllocator(hold=10, rng=random.Random(0))
+    name = allocator.allocate()
+    allocator.observe("add_room", ("host", f"host/{name}", "Host"))
+    clock[0] += 60
+
+    names = {allocator.allocate() for _ in range(allocator.base_size // 2)}
+    assert name not in names
+
+    allocator.observe("close_room", (f"host/{name}",))
+    assert name not in allocator.in_use
+
+
+def test_held_names_expire(clock: List[float]) -> None:
+    rng = random.Random(0)
+    allocator = RoomNameAllocator(hold=10, rng=rng)
+    name = allocator.allocate()
+
+    rng.seed(0)
+    assert allocator.allocate() != name
+
+    clock[0] += 11
+    rng.seed(0)
+    assert allocator.allocate() == name
+
+
+def test_tiers_shrink_when_holds_expire(clock: List[float]) -> None:
+    allocator = RoomNameAllocator(hold=10, rng=random.Random(0))
+    # The size is checked before each name is held
+    for _ in range(allocator.base_size // 2 + 2):
+        allocator.allocate()
+    assert allocator.tiers == 2
+
+    clock[0] += 11
+    allocator.allocate()
+    assert len(allocator.held) == 1
+    assert allocator.tiers == 1
@@ -0,0 +1,137 @@
+import asyncio
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+import aiohttp
+import pytest
+from aiohttp_spotify import SpotifyAuth
+
+from spotify_party.ratelimit import RateLimited, RequestScheduler
+
+
+class FakeResponse:
+    def __init__(self, status: int, headers: Optional[Dict] = None):
+        self.status = status
+        self.headers = headers or {}
+
+    async def __aenter__(self) -> "FakeResponse":
+        return self
+
+    async def __aexit__(self, *args: Any) -> None:
+        pass
+
+    def raise_for_status(self) -> None:
+        if self.status >= 400:
+            raise aiohttp.ClientResponseError(
+                None, (), status=self.status  # type: ignore
+            )
+
+    async def read(self) -> bytes:
+        return b"{}"
+
+
+class FakeSession:
+    def __init__(self, responses: Sequence[FakeResponse]):
+        self.responses = list(responses)
+        self.calls = 0
+
+    def request(self, method: str, url: str, **kwargs: Any) -> FakeResponse:
+        self.calls += 1
+        return self.responses.pop(0)
+
+
+@pytest.fixture
+def clock(monkeypatch: pytest.MonkeyPatch) -> List[float]:
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def sleeps(monkeypatch: pytest.MonkeyPatch, clock: List[float]) -> List[float]:
+    delays = []
+
+    # The clock stands still, so the waits add up like concurrent calls
+    async def sleep(delay: float) -> None:
+        delays.append(delay)
+
+    monkeypatch.setattr(asyncio, "sleep", sleep)
+    return delays
+
+
+def get_auth(token: str = "token") -> SpotifyAuth:
+    return SpotifyAuth(token, "refresh", 0)
+
+
+def request(
+    scheduler: RequestScheduler, session: FakeSession, token: str = "token"
+) -> Any:
+    return scheduler.request(
+        session, "https://api", get_auth(token), "/me"  # type: ignore
+    )
+
+
+def test_calls_are_only_throttled_per_token(sleeps: List[float]) -> None:
+    async def run() -> None:
+        scheduler = RequestScheduler(token_rate=5.0)
+        for n in range(100):
+            await scheduler.acquire(f"token{n}")
+        assert sleeps == []
+
+        for _ in range(5):
+            await scheduler.acquire("token")
+        await scheduler.acquire("token")
+        assert sleeps == [pytest.approx(0.2)]
+        assert scheduler.throttled == 1
+
+    asyncio.run(run())
+
+
+def test_calls_past_max_wait_are_dropped(sleeps: List[float]) -> None:
+    async def run() -> None:
+        scheduler = RequestScheduler(token_rate=1.0, max_wait=2.0)
+        for _ in range(3):
+            await scheduler.acquire("token")
+        for _ in range(2):
+            # The dropped call gives its token back, so the next one waits
+            # as long
+            with pytest.raises(RateLimited):
+                await scheduler.acquire("token")
+        assert scheduler.dropped == 2
+        assert sleeps == [pytest.approx(1.0), pytest.approx(2.0)]
+
+    asyncio.run(run())
+
+
+def test_retry_after_blocks_every_call(sleeps: List[float]) -> None:
+    async def run() -> None:
+        scheduler = RequestScheduler()
+        session = FakeSession(
+            [FakeResponse(429, {"Retry-After": "3"}), FakeResponse(200)]
+        )
+        response = await request(scheduler, session)
+        assert response.status == 200
+        assert session.calls == 2
+        assert sleeps == [pytest.approx(3.0)]
+        assert (scheduler.throttled, scheduler.retried) == (2, 1)
+
+        # Other tokens wait for the same period, or are dropped
+        scheduler.block(20.0)
+        with pytest.raises(RateLimited):
+            await scheduler.acquire("other")
+
+    asyncio.run(run())
+
+
+def test_server_errors_are_retried_with_backoff(sleeps: List[float]) -> None:
+    async def run() -> None:
+        scheduler = RequestScheduler(max_retries=2, backoff=0.5)
+        session = FakeSession([FakeResponse(503) for _ in range(3)])
+        with pytest.raises(aiohttp.ClientResponseError):
+            await request(scheduler, session)
+        assert session.calls == 3
+        assert (scheduler.retried, scheduler.dropped) == (2, 1)
+        assert len(sleeps) == 2
+        assert 0 <= sleeps[0] <= 0.5 and 0 <= sleeps[1] <= 1.0
+
+    asyncio.run(run())
@@ -0,0 +1,71 @@
+import asyncio
+import base64
+
+from aiohttp import web
+from aiohttp.test_utils import make_mocked_request
+from cryptography import fernet
+
+from spotify_party.sessions import CachedEncryptedCookieStorage
+
+
+def get_storage() -> CachedEncryptedCookieStorage:
+    key = base64.urlsafe_b64decode(fernet.Fernet.generate_key())
+    return CachedEncryptedCookieStorage(key)
+
+
+def get_request(
+    storage: CachedEncryptedCookieStorage, cookie: str
+) -> web.Request:
+    return make_mocked_request(
+        "GET", "/", headers={"Cookie": f"{storage.cookie_name}={cookie}"}
+    )
+
+
+async def get_cookie(
+    storage: CachedEncryptedCookieStorage, user_id: str
+) -> str:
+    session = await storage.new_session()
+    session["sp_user_id"] = user_id
+    response = web.Response()
+    await storage.save_session(
+        make_mocked_request("GET", "/"), response, session
+    )
+    return response.cookies[storage.cookie_name].value
+
+
+def test_changed_session_is_saved_after_cache_miss():
+    async def run():
+        storage = get_storage()
+        cookie = await get_cookie(storage, "a")
+        storage.cache.clear()
+
+        request = get_request(storage, cookie)
+        session = await storage.load_session(request)
+        assert session["sp_user_id"] == "a"
+        session["sp_user_id"] = "b"
+        response = web.Response()
+        await storage.save_session(request, response, session)
+        assert storage.cookie_name in response.cookies
+        assert storage.unchanged == 0
+
+        # The old cookie still holds the old session
+        session = await storage.load_session(get_request(storage, cookie))
+        assert session["sp_user_id"] == "a"
+
+    asyncio.run(run())
+
+
+def test_unchanged_session_is_not_saved():
+    async def run():
+        storage = get_storage()
+        cookie = await get_cookie(storage, "a")
+
+        request = get_request(storage, cookie)
+        session = await storage.load_session(request)
+        session["sp_user_id"] = "a"
+        response = web.Response()
+        await storage.save_session(request, response, session)
+        assert storage.cookie_name not in response.cookies
+        assert storage.unchanged == 1
+
+    asyncio.run(run())
@@ -0,0 +1,19 @@
+import subprocess
+import sys
+
+# Slow imports that the package shouldn't need until the server starts
+LAZY_MODULES = ("pkg_resources", "socketio", "jinja2")
+
+
+def test_package_import_is_lazy() -> None:
+    code = (
+        "import sys\nimport spotify_party\n"
+        f"print(' '.join(m for m in {LAZY_MODULES!r} if m in sys.modules))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    assert result.stdout.split() == []